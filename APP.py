@@ -2,11 +2,21 @@ import streamlit as st
 import datetime
 import pandas as pd
 import altair as alt
-import re
+import os
+import json
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from streamlit_option_menu import option_menu
 from streamlit_extras.metric_cards import style_metric_cards
-import math
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import plotly.express as px
+import plotly.graph_objects as go
+from pandas.tseries.api import guess_datetime_format
+from data_utils import norm_series, find_col, duplicate_index, duplicate_masks
 
 
 # ================== PAGE CONFIG ==================
@@ -18,22 +28,170 @@ st.set_page_config(
 )
 
 # ================== HELPER FUNCTIONS ==================
-def norm(s: str) -> str:
-    return re.sub(r'[^a-z0-9]+', '', str(s).strip().lower())
-
-def find_col(df_cols, candidates):
-    cand_norm = {norm(c) for c in candidates}
-    for c in df_cols:
-        if norm(c) in cand_norm:
-            return c
-    return None
-
-def categorize_weeks(days):
-    if pd.isna(days):
+def week_buckets(days):
+    """Lead age in days -> week number as a compact nullable int (NaN -> <NA>).
+
+    "Week 0" (0-6 days), "Week 1" (7-13 days), "Week -1" (-1 to -7 days):
+    floor division handles both signs.
+    """
+    return np.floor_divide(days, 7).astype("Int16")
+
+def week_labels(weeks):
+    # Display only: 3 -> "Week 3"
+    return "Week " + weeks.astype(str)
+
+def to_categorical(df, columns):
+    """Stores low-cardinality text columns as pandas categoricals (sorted, stable category set)."""
+    for c in columns:
+        if c not in df.columns:
+            continue
+        if isinstance(df[c].dtype, pd.CategoricalDtype):
+            # (categories of a frame read back from Parquet row groups come in file order)
+            categories = df[c].cat.remove_unused_categories().cat.categories
+            df[c] = df[c].cat.set_categories(sorted(categories, key=str))
+        else:
+            df[c] = df[c].astype(pd.CategoricalDtype(sorted(df[c].dropna().unique(), key=str)))
+    return df
+
+def add_days_since_created(df):
+    # Recomputed on every load (also from the disk cache) so it always counts from today
+    if "Created Time (Date)" in df.columns:
+        today = pd.Timestamp.now().normalize()
+        df["Days Since Created"] = (today - df["Created Time (Date)"]).dt.days
+    return df
+
+# ================== DISK CACHE (Parquet) ==================
+# The cleaned Dr Chase frame is saved next to the app and reused on cold starts
+# as long as the CSV and the mapping config did not change.
+DR_CHASE_FILE = "Dr_Chase_Leads.csv"
+CACHE_DIR = ".dashboard_cache"
+CLEANING_VERSION = 6  # 👈 bump when load_and_clean_data changes its output
+
+def file_fingerprint(path, with_hash=True):
+    """Size, mtime and (optionally) sha256 of a file."""
+    stat = os.stat(path)
+    fp = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        fp["sha256"] = h.hexdigest()
+    return fp
+
+def config_fingerprint(name_map, samy_chasers, cols_map):
+    """Hash of everything besides the CSV itself that shapes the cleaned output."""
+    payload = json.dumps({
+        "version": CLEANING_VERSION,
+        "name_map": name_map,
+        "samy_chasers": sorted(samy_chasers),
+        "cols_map": cols_map,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def cache_paths(path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return (
+        os.path.join(CACHE_DIR, f"{stem}.parquet"),
+        os.path.join(CACHE_DIR, f"{stem}.meta.json"),
+    )
+
+def read_cleaned_cache(path, config_key, require_fresh=True):
+    """Return the cached cleaned frame for `path`, or None if it is missing or stale.
+
+    With require_fresh=False the last snapshot is returned even if the CSV has
+    changed since (used as the base for an incremental refresh).
+    """
+    data_path, meta_path = cache_paths(path)
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("config") != config_key:
         return None
-    # 🆕 (FIXED) "Week 0" (0-6 days), "Week 1" (7-13 days), "Week -1" (-1 to -7 days)
-    # math.floor() بتظبط الحالتين
-    return f"Week {math.floor(days / 7)}"
+
+    current = file_fingerprint(path, with_hash=False)
+    if require_fresh and (meta.get("size"), meta.get("mtime_ns")) != (current["size"], current["mtime_ns"]):
+        # mtime/size changed -> only trust the cache if the content is byte-identical
+        if meta.get("size") != current["size"]:
+            return None
+        current = file_fingerprint(path)
+        if meta.get("sha256") != current["sha256"]:
+            return None
+        meta.update(current)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    try:
+        df = pd.read_parquet(data_path)
+    except Exception:
+        return None
+    df.attrs.update(meta.get("attrs", {}))
+    return finish_cleaned_frame(df)
+
+def write_cleaned_cache(path, config_key, df, source_fp, notes):
+    """Save the cleaned frame + fingerprint. Failing to write the cache is never fatal (a note is added)."""
+    data_path, meta_path = cache_paths(path)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(data_path + ".tmp", index=False)
+        os.replace(data_path + ".tmp", data_path)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({**source_fp, "config": config_key}, f)
+    except Exception as e:
+        notes.append(("warning", f"Could not write the data cache ({e}). The dashboard will keep working without it."))
+
+def chunk_schema(chunk):
+    """Parquet schema of the first cleaned chunk, loosened so every later chunk fits it.
+
+    Categoricals get one dictionary type (each chunk has its own categories) and text
+    columns that are all NaN in this chunk (Arrow type null) are stored as strings.
+    """
+    schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_dictionary(field.type):
+            schema = schema.set(i, field.with_type(pa.dictionary(pa.int32(), pa.string())))
+        elif pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+def write_cleaned_chunks(path, config_key, chunks, source_fp, attrs, notes):
+    """Stream cleaned chunks into the disk cache (one row group each) -> True if it was written.
+
+    Only one chunk is in memory at a time. `attrs` (filled while `chunks` is consumed)
+    is kept in the meta file; the schema is fixed by the first chunk.
+    """
+    data_path, meta_path = cache_paths(path)
+    writer = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        for chunk in chunks:
+            if writer is None:
+                schema = chunk_schema(chunk)
+                writer = pq.ParquetWriter(data_path + ".tmp", schema)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        writer.close()
+        os.replace(data_path + ".tmp", data_path)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({**source_fp, "config": config_key, "attrs": attrs}, f)
+        return True
+    except Exception as e:
+        if writer is not None:
+            writer.close()
+        notes.append(("warning", f"Could not write the data cache ({e}). The data is cleaned in memory instead."))
+        return False
+
+def finish_cleaned_frame(df):
+    """Whole-file shape of a frame put together from cleaned chunks (no-op for a single clean).
+
+    A " (Time)" column only exists where its date column has a value, and categories
+    are sorted over the whole file. Columns are dropped in place (no copy of the frame).
+    """
+    for c in DATE_COLUMNS_ORIGINAL:
+        if f"{c} (Time)" in df.columns and c in df.columns and df[c].isna().all():
+            del df[f"{c} (Time)"]
+    return to_categorical(df, DR_CHASE_CATEGORY_COLS)
 
 # ================== SYNONYMS & MAPS ==================
 syn = {
@@ -66,57 +224,119 @@ samy_chasers = {
     "Sarah Adams", "Timothy Williams"
 }
 
-# ⚠️ Load Raw Data (Initial Check)
+# ⚠️ Load Raw Header (Initial Check) - the full file is only read on a cache miss
+@st.cache_data
+def read_csv_header(file_path, source_stat):
+    # source_stat = (size, mtime_ns): part of the cache key only
+    return pd.read_csv(file_path, nrows=0).columns.str.strip()
+
 try:
-    df_raw = pd.read_csv("Dr_Chase_Leads.csv", low_memory=False)
+    dr_chase_stat = os.stat(DR_CHASE_FILE)
+    dr_chase_stat = (dr_chase_stat.st_size, dr_chase_stat.st_mtime_ns)
+    raw_columns = read_csv_header(DR_CHASE_FILE, dr_chase_stat)
 except FileNotFoundError:
     st.error("⚠️ خطأ: لم يتم العثور على الملف 'Dr_Chase_Leads.csv'. يرجى التأكد من وجود الملف في نفس المجلد.")
     st.stop()
-df_raw.columns = df_raw.columns.str.strip()
 
 cols_map = {
-    "created_time": find_col(df_raw.columns, syn["created_time"]),
-    "assign_date": find_col(df_raw.columns, syn["assign_date"]),
-    "approval_date": find_col(df_raw.columns, syn["approval_date"]),
-    "completion_date": find_col(df_raw.columns, syn["completion_date"]),
-    "uploaded_date": find_col(df_raw.columns, syn["uploaded_date"]),
-    "assigned_to_chase": find_col(df_raw.columns, syn["assigned_to_chase"]),
+    "created_time": find_col(raw_columns, syn["created_time"]),
+    "assign_date": find_col(raw_columns, syn["assign_date"]),
+    "approval_date": find_col(raw_columns, syn["approval_date"]),
+    "completion_date": find_col(raw_columns, syn["completion_date"]),
+    "uploaded_date": find_col(raw_columns, syn["uploaded_date"]),
+    "assigned_to_chase": find_col(raw_columns, syn["assigned_to_chase"]),
 }
 
+# ================== DATE PARSING ==================
+def parse_date_column(series, dayfirst=True, first_value=None):
+    """Parses a raw date column; returns (datetime series, number of unparsable values).
+
+    Same result as pd.to_datetime(series, errors="coerce", dayfirst=dayfirst), but the
+    format is detected once from the first value and every distinct string is parsed
+    only once (timestamps repeat a lot in the export). Datetime columns are returned as-is.
+    `first_value` overrides the value the format is guessed from (chunked ingest passes
+    the first value of the whole file so every chunk uses the same format).
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series, 0
+    if series.dtype != object:
+        parsed = pd.to_datetime(series, errors="coerce", dayfirst=dayfirst)
+        return parsed, int((series.notna() & parsed.isna()).sum())
+
+    codes, uniques = pd.factorize(series)  # uniques keep first-seen order, NaN -> code -1
+    if first_value is None and len(uniques):
+        first_value = uniques[0]
+    fmt = guess_datetime_format(str(first_value), dayfirst=dayfirst) if first_value is not None else None
+    if fmt:
+        parsed_uniques = pd.to_datetime(uniques, format=fmt, errors="coerce")
+    else:
+        parsed_uniques = pd.to_datetime(uniques, errors="coerce", dayfirst=dayfirst)
+
+    parsed = pd.Series(
+        pd.DatetimeIndex(parsed_uniques).take(codes, allow_fill=True, fill_value=pd.NaT),
+        index=series.index, name=series.name
+    )
+    failed_uniques = np.asarray(parsed_uniques.isna())
+    return parsed, int(failed_uniques[codes[codes >= 0]].sum())
+
 # ================== DATA CLEANING & CACHING FUNCTION ==================
-@st.cache_data
-def load_and_clean_data(df, name_map, cols_map, samy_chasers):
+# Filtered / grouped on every rerun -> stored as categoricals
+DR_CHASE_CATEGORY_COLS = [
+    "Client", "Chaser Name", "Chaser Group", "Chasing Disposition", "Chasing Disposition_clean",
+    "Insurance", "Type Of Sale", "Products",
+]
+OPLAN_CATEGORY_COLS = ["Assign To_clean", "Client_OPlan"]
+
+LEAD_KEY_COL = "Dr Chase Lead Number"
+LEAD_MODIFIED_COL = "Modified Time"
+
+COLUMNS_TO_REMOVE = [
+    "Is Converted From Lead", "Height", "Weight", "Waist Size", "Dr Phone Number", "Dr Fax",
+    "Dr Alternative Phone", "Dr Address", "Dr City", "Dr ZIP Code", "NPI", "Dr Info Extra Comments",
+    "Dr. Name", "Exception", "Initial Agent", "Secondary Phone", "Address",
+    "Gender", "ZIP Code", "City", "Phase","First Name","LOMN?","Source","Brace Size","Extra Comments" ,"CBA","Primary Phone"
+]
+DATE_COLUMNS_ORIGINAL = [
+    "Created Time", "Assigned date", "Completion Date", "Approval date",
+    "Denial Date", "Modified Time", "Date of Sale", "Upload Date", 
+]
+CORE_DATE_KEYS = ["created_time", "assign_date", "approval_date", "completion_date", "uploaded_date"]
+
+def load_and_clean_data(df, name_map, cols_map, samy_chasers, previous=None, date_first_values=None):
+    """Cleans the raw Dr Chase frame.
+
+    If `previous` (the last cleaned snapshot) is given, only rows that are new or
+    whose Modified Time changed are cleaned; the rest are reused from the snapshot.
+    `date_first_values` is only used by the chunked ingest (see parse_date_column).
+    """
+    date_first_values = date_first_values or {}
+    if previous is not None:
+        df_cleaned = clean_changed_rows(df, previous, name_map, cols_map, samy_chasers)
+        if df_cleaned is not None:
+            return df_cleaned
+
     df_cleaned = df.copy()
     
     # 1. Remove columns
-    columns_to_remove = [
-        "Is Converted From Lead", "Height", "Weight", "Waist Size", "Dr Phone Number", "Dr Fax",
-        "Dr Alternative Phone", "Dr Address", "Dr City", "Dr ZIP Code", "NPI", "Dr Info Extra Comments",
-        "Dr. Name", "Exception", "Initial Agent", "Secondary Phone", "Address",
-        "Gender", "ZIP Code", "City", "Phase","First Name","LOMN?","Source","Brace Size","Extra Comments" ,"CBA","Primary Phone"
-    ]
-    df_cleaned = df_cleaned.drop(columns=[c for c in columns_to_remove if c in df_cleaned.columns], errors="ignore")
+    # (the loader already skips these via usecols; kept for frames built elsewhere)
+    df_cleaned = df_cleaned.drop(columns=[c for c in COLUMNS_TO_REMOVE if c in df_cleaned.columns], errors="ignore")
 
     # 2. Date Conversion
-    date_columns_original = [
-        "Created Time", "Assigned date", "Completion Date", "Approval date",
-        "Denial Date", "Modified Time", "Date of Sale", "Upload Date", 
-    ]
-
-    for col in date_columns_original:
+    date_parse_failures = {}
+    for col in DATE_COLUMNS_ORIGINAL:
         if col in df_cleaned.columns:
             # Convert to datetime (day first format is assumed: DD/MM/YYYY)
-            df_cleaned[col] = pd.to_datetime(
-                df_cleaned[col], 
-                errors="coerce", 
-                dayfirst=True, 
-                infer_datetime_format=True
+            df_cleaned[col], date_parse_failures[col] = parse_date_column(
+                df_cleaned[col], dayfirst=True, first_value=date_first_values.get(col)
             )
 
             # Create additional split columns for date/time (used for st.dataframe)
-            df_cleaned[col + " (Date)"] = df_cleaned[col].dt.date
-            if df_cleaned[col].dt.time.notna().any():
-                df_cleaned[col + " (Time)"] = df_cleaned[col].dt.time
+            # (Date) = datetime64 at midnight, (Time) = seconds since midnight (Int32)
+            df_cleaned[col + " (Date)"] = df_cleaned[col].dt.normalize()
+            if df_cleaned[col].notna().any():
+                df_cleaned[col + " (Time)"] = (
+                    (df_cleaned[col] - df_cleaned[col + " (Date)"]).dt.total_seconds().astype("Int32")
+                )
 
     # 3. Chaser Name Mapping and Grouping
     assigned_col = cols_map["assigned_to_chase"]
@@ -127,37 +347,253 @@ def load_and_clean_data(df, name_map, cols_map, samy_chasers):
             .map(name_map)                       # <-- This maps using the (now) lowercase key
             .fillna(df_cleaned[assigned_col])    # <-- This fills if map fails
         )
-        df_cleaned["Chaser Group"] = df_cleaned["Chaser Name"].apply(
-            lambda n: "Samy Chasers" if n in samy_chasers else "Andrew Chasers"
+        df_cleaned["Chaser Group"] = np.where(
+            df_cleaned["Chaser Name"].isin(samy_chasers), "Samy Chasers", "Andrew Chasers"
         )
     
     # 4. Ensure core columns used for calculation are datetime
-    date_actual_cols = [cols_map[k] for k in ["created_time","assign_date","approval_date","completion_date","uploaded_date"] if cols_map[k]]
+    date_actual_cols = [cols_map[k] for k in CORE_DATE_KEYS if cols_map[k]]
     for c in date_actual_cols:
         if c in df_cleaned.columns:
-            df_cleaned[c] = pd.to_datetime(df_cleaned[c], errors="coerce")
+            # no-op for the columns already parsed in step 2
+            df_cleaned[c], failures = parse_date_column(
+                df_cleaned[c], dayfirst=False, first_value=date_first_values.get(c)
+            )
+            date_parse_failures[c] = date_parse_failures.get(c, failures)
+    df_cleaned.attrs["date_parse_failures"] = date_parse_failures
             
     # 5. Clean MCN and Chasing Disposition for merging
     if "MCN" in df_cleaned.columns:
-        df_cleaned["MCN_clean"] = df_cleaned["MCN"].apply(norm)
+        df_cleaned["MCN_clean"] = norm_series(df_cleaned["MCN"])
         
     if "Chasing Disposition" in df_cleaned.columns:
         df_cleaned["Chasing Disposition_clean"] = df_cleaned["Chasing Disposition"].fillna('').astype(str).str.strip().str.lower()
     
+    # 6. Low-cardinality dimensions -> categoricals
+    df_cleaned = to_categorical(df_cleaned, DR_CHASE_CATEGORY_COLS)
+
     # --- 🔽🔽🔽 (FIX) 
-    if "Created Time (Date)" in df_cleaned.columns:
-        today = pd.Timestamp.now().normalize()
-        df_cleaned["Days Since Created"] = (
-            today - pd.to_datetime(df_cleaned["Created Time (Date)"], errors="coerce")
-        ).dt.days
+    df_cleaned = add_days_since_created(df_cleaned)
     # --- 🔼🔼🔼 ---
     
     return df_cleaned
 
 
-@st.cache_data
+def clean_changed_rows(df_raw, previous, name_map, cols_map, samy_chasers):
+    """Incremental mode of load_and_clean_data (upsert by Dr Chase Lead Number).
+
+    Returns None when the files can't be matched row by row (missing key columns,
+    duplicated lead numbers or a different column layout) -> full clean.
+    """
+    key, mod = LEAD_KEY_COL, LEAD_MODIFIED_COL
+    if key not in df_raw.columns or mod not in df_raw.columns or key not in previous.columns:
+        return None
+    if df_raw[key].duplicated().any() or previous[key].duplicated().any():
+        return None
+
+    # Same parsing rule as step 2 of load_and_clean_data, on one column only
+    raw_modified, _ = parse_date_column(df_raw[mod], dayfirst=True)
+    prev_modified = df_raw[key].map(previous.set_index(key)[mod])
+    unchanged = df_raw[key].isin(previous[key]) & (
+        (raw_modified == prev_modified) | (raw_modified.isna() & prev_modified.isna())
+    )
+
+    changed_rows = df_raw[~unchanged.to_numpy()]
+    if len(changed_rows) == len(df_raw):
+        return None
+
+    kept = previous.set_index(key).loc[df_raw.loc[unchanged.to_numpy(), key]].reset_index()
+    kept.index = df_raw.index[unchanged.to_numpy()]
+    kept = kept[previous.columns]
+
+    if changed_rows.empty:
+        df_cleaned = kept
+    else:
+        delta = load_and_clean_data(changed_rows, name_map, cols_map, samy_chasers)
+        # New/removed CSV columns -> the snapshot no longer matches, redo everything
+        # (" (Time)" columns are only added when the cleaned rows have a time part)
+        if set(delta.columns) - set(previous.columns) or any(
+            c not in delta.columns and not c.endswith(" (Time)") for c in previous.columns
+        ):
+            return None
+        missing_cols = [c for c in previous.columns if c not in delta.columns]
+        delta = delta.reindex(columns=previous.columns)
+        for c in missing_cols:
+            delta[c] = delta[c].astype(previous[c].dtype)
+        df_cleaned = pd.concat([kept, delta]).sort_index()
+    # concat turns categoricals with different category sets into object -> rebuild them
+    df_cleaned = to_categorical(df_cleaned, DR_CHASE_CATEGORY_COLS)
+
+    # A value failed to parse if it was present in the CSV but is NaT after cleaning
+    df_cleaned.attrs["date_parse_failures"] = {
+        c: int((df_raw[c].notna().to_numpy() & df_cleaned[c].isna().to_numpy()).sum())
+        for c in previous.attrs.get("date_parse_failures", {})
+        if c in df_raw.columns and c in df_cleaned.columns
+    }
+    return add_days_since_created(df_cleaned)
+
+
+# ================== READ PLAN (usecols + dtypes) ==================
+DR_CHASE_TEXT_COLS = ["MCN", "Chasing Disposition", "Dr Name", "Last Modified By", "Next Follow-up Date"]
+
+def dr_chase_read_plan(file_path, cols_map):
+    """Returns (usecols, dtypes) for pd.read_csv, derived from the cleaning rules.
+
+    Only the header is read. Dropped columns are never parsed, date and text inputs of
+    the cleaning steps stay strings, untouched dimensions are read straight into
+    categoricals. Columns no rule knows about are still inferred by pandas (numeric
+    columns included: a forced integer dtype fails the whole read on one stray value).
+    """
+    header = pd.read_csv(file_path, nrows=0).columns
+    # Chasing Disposition + the assigned column are rewritten by the cleaning -> plain text
+    cleaned_inputs = {"Chasing Disposition", cols_map["assigned_to_chase"]}
+    rules = {c: "category" for c in DR_CHASE_CATEGORY_COLS if c not in cleaned_inputs}
+    rules.update({c: "object" for c in DR_CHASE_TEXT_COLS})
+    rules.update({c: "object" for c in cleaned_inputs if c})
+    rules.update({c: "object" for c in DATE_COLUMNS_ORIGINAL})
+    rules.update({cols_map[k]: "object" for k in CORE_DATE_KEYS if cols_map[k]})
+
+    usecols = [c for c in header if c.strip() not in COLUMNS_TO_REMOVE]
+    dtypes = {c: rules[c.strip()] for c in usecols if c.strip() in rules}
+    return usecols, dtypes
+
+
+# ================== CHUNKED INGEST (oversized exports) ==================
+STREAM_INGEST_MIN_BYTES = 256 * 1024 * 1024  # 👈 bigger CSVs are cleaned chunk by chunk
+STREAM_CHUNK_ROWS = 100_000
+
+def chunk_dtype_kind(values):
+    """dtype kind of one chunk's column ("empty" if all NaN, "bO" for bools mixed with NaN)."""
+    non_null = values.dropna()
+    if non_null.empty:
+        return "empty"
+    if values.dtype == object and non_null.map(type).eq(bool).all():
+        return "bO"
+    return values.dtype.kind
+
+def merge_chunk_dtypes(kinds):
+    """The dtype a whole-file read would infer, from the dtype kinds seen per chunk.
+
+    "bool-object" means bools mixed with NaN: read as inferred, then cast to object
+    (dtype=object would keep "True"/"False" as strings).
+    """
+    has_empty = "empty" in kinds
+    kinds = kinds - {"empty"}
+    if not kinds:
+        return "float64"
+    if kinds == {"b"} and not has_empty:
+        return "bool"
+    if kinds <= {"b", "bO"}:
+        return "bool-object"
+    if "O" in kinds or "bO" in kinds or "b" in kinds:
+        return "object"
+    if kinds == {"i"} and not has_empty:
+        return "int64"
+    if kinds == {"u"} and not has_empty:
+        return "uint64"
+    return "float64"
+
+def scan_csv(file_path, chunk_rows, date_cols, usecols=None, dtypes=None):
+    """Pass 1: dtypes of the columns not in `dtypes` + the first value of each date column."""
+    dtypes = dtypes or {}
+    kinds, first_values = {}, {}
+    for chunk in pd.read_csv(file_path, chunksize=chunk_rows, usecols=usecols, dtype=dtypes, low_memory=False):
+        for raw_col in chunk.columns:
+            values = chunk[raw_col]
+            if raw_col not in dtypes:
+                kinds.setdefault(raw_col, set()).add(chunk_dtype_kind(values))
+            col = raw_col.strip()
+            if col in date_cols and col not in first_values and values.notna().any():
+                first_values[col] = values.dropna().iloc[0]
+    return {raw_col: merge_chunk_dtypes(k) for raw_col, k in kinds.items()}, first_values
+
+def stream_clean_csv(file_path, name_map, cols_map, samy_chasers, date_parse_failures, chunk_rows=STREAM_CHUNK_ROWS):
+    """Cleans the CSV chunk by chunk -> yields the cleaned chunks, all with one column layout.
+
+    Only one raw chunk is in memory at a time; the CSV is read twice (dtypes and date
+    formats of the whole file are settled first, so every chunk is cleaned the same way).
+    Every chunk carries each " (Time)" column the file can produce (Int32, empty where a
+    chunk has no time values) and no "Days Since Created"; see finish_cleaned_frame.
+    Parse failures are added up in `date_parse_failures`.
+    """
+    date_cols = set(DATE_COLUMNS_ORIGINAL) | {cols_map[k] for k in CORE_DATE_KEYS if cols_map[k]}
+    usecols, dtypes = dr_chase_read_plan(file_path, cols_map)
+    inferred, first_values = scan_csv(file_path, chunk_rows, date_cols, usecols, dtypes)
+    bool_object_cols = [c for c, d in inferred.items() if d == "bool-object"]
+    dtypes = {**{c: d for c, d in inferred.items() if d != "bool-object"}, **dtypes}
+
+    columns = None
+    for chunk in pd.read_csv(file_path, chunksize=chunk_rows, usecols=usecols, dtype=dtypes, low_memory=False):
+        chunk[bool_object_cols] = chunk[bool_object_cols].astype(object)
+        chunk.columns = chunk.columns.str.strip()
+        cleaned = load_and_clean_data(chunk, name_map, cols_map, samy_chasers, date_first_values=first_values)
+        for c, n in cleaned.attrs["date_parse_failures"].items():
+            date_parse_failures[c] = date_parse_failures.get(c, 0) + n
+        if columns is None:
+            # A date column with any value in the file gets its " (Time)" right after its " (Date)"
+            columns = []
+            for c in cleaned.columns:
+                if c.endswith(" (Time)") or c == "Days Since Created":
+                    continue
+                columns.append(c)
+                if c.endswith(" (Date)") and c[:-len(" (Date)")] in first_values:
+                    columns.append(c.replace(" (Date)", " (Time)"))
+        yield cleaned.reindex(columns=columns).astype({c: "Int32" for c in columns if c.endswith(" (Time)")})
+
+
+# Loaders whose body actually ran in this script run (a cache hit doesn't add to it).
+# Each rerun executes the script again, so the set starts empty every time.
+loaders_ran = set()
+
+@st.cache_resource(show_spinner=False)
+def load_dr_chase_data(file_path, source_stat, name_map, cols_map, samy_chasers, today):
+    """Reads + cleans the Dr Chase CSV (or its disk cache) -> (frame, notes).
+
+    Only small arguments are hashed by Streamlit: `source_stat` (size, mtime_ns)
+    and `today` are part of the cache key only, so a rerun never touches the file.
+    Like the index builders it is a cache_resource: every rerun gets the same frame
+    (no unpickled copy), so callers only read it.
+    It runs in a loader thread, so it calls no st.* function: problems come back as
+    (level, message) notes for the main thread to show.
+    """
+    loaders_ran.add("Dr Chase")
+    notes = []
+    cache_key = config_fingerprint(name_map, samy_chasers, cols_map)
+    df_cleaned = read_cleaned_cache(file_path, cache_key)
+    if df_cleaned is not None:
+        return add_days_since_created(df_cleaned), notes
+
+    source_fp = file_fingerprint(file_path)  # taken before the read so a concurrent rewrite invalidates it
+    if source_fp["size"] >= STREAM_INGEST_MIN_BYTES:
+        # Cleaned chunks go straight into the disk cache; only the finished file is read back
+        date_parse_failures = {}
+        chunks = stream_clean_csv(file_path, name_map, cols_map, samy_chasers, date_parse_failures)
+        if write_cleaned_chunks(file_path, cache_key, chunks, source_fp, {"date_parse_failures": date_parse_failures}, notes):
+            df_cleaned = read_cleaned_cache(file_path, cache_key, require_fresh=False)
+            if df_cleaned is not None:
+                return add_days_since_created(df_cleaned), notes
+        # No disk cache to stream into -> the chunks are put together in memory
+        date_parse_failures.clear()
+        df_cleaned = finish_cleaned_frame(
+            pd.concat(stream_clean_csv(file_path, name_map, cols_map, samy_chasers, date_parse_failures))
+        )
+        df_cleaned.attrs["date_parse_failures"] = date_parse_failures
+        return add_days_since_created(df_cleaned), notes
+    else:
+        usecols, dtypes = dr_chase_read_plan(file_path, cols_map)
+        df_raw = pd.read_csv(file_path, usecols=usecols, dtype=dtypes, low_memory=False)
+        df_raw.columns = df_raw.columns.str.strip()
+        previous = read_cleaned_cache(file_path, cache_key, require_fresh=False)
+        df_cleaned = load_and_clean_data(df_raw, name_map, cols_map, samy_chasers, previous=previous)
+    write_cleaned_cache(file_path, cache_key, df_cleaned, source_fp, notes)
+    return df_cleaned, notes
+
+
+@st.cache_resource(show_spinner=False)
 def load_oplan_data(file_path="O_Plan_Leads.csv"):
-    """Loads and cleans the O Plan leads file."""
+    """Loads and cleans the O Plan leads file -> (frame, notes), like load_dr_chase_data."""
+    loaders_ran.add("O Plan")
+    notes = []
     try:
         df = pd.read_csv(file_path)
         df.columns = df.columns.str.strip()
@@ -171,7 +607,7 @@ def load_oplan_data(file_path="O_Plan_Leads.csv"):
             if actual_closing_col != "Closing Status_clean":
                 df = df.drop(columns=[actual_closing_col])
         else:
-            st.warning("Column 'Closing Status' not found in O_Plan_Leads.csv. Cannot perform conflict check.")
+            notes.append(("warning", "Column 'Closing Status' not found in O_Plan_Leads.csv. Cannot perform conflict check."))
             
         # 2. Find "Assign To" column (case-insensitive)
         assign_to_syns = ["Assign To", "Assign to", "assigned to", "agent", "Assigned To"]
@@ -182,18 +618,18 @@ def load_oplan_data(file_path="O_Plan_Leads.csv"):
             if actual_assign_col != "Assign To_clean":
                 df = df.drop(columns=[actual_assign_col])
         else:
-            st.warning("Column 'Assign To' not found in O_Plan_Leads.csv. Cannot perform agent analysis.")
+            notes.append(("warning", "Column 'Assign To' not found in O_Plan_Leads.csv. Cannot perform agent analysis."))
         
         # 3. Find "MCN" column (case-insensitive)
         mcn_syns = ["MCN", "mcn"]
         actual_mcn_col = find_col(df.columns, mcn_syns) 
 
         if actual_mcn_col:
-            df["MCN_clean"] = df[actual_mcn_col].apply(norm)
+            df["MCN_clean"] = norm_series(df[actual_mcn_col])
             if actual_mcn_col != "MCN_clean":
                 df = df.drop(columns=[actual_mcn_col])
         else:
-            st.warning("Column 'MCN' not found in O_Plan_Leads.csv. Cannot perform conflict check.")
+            notes.append(("warning", "Column 'MCN' not found in O_Plan_Leads.csv. Cannot perform conflict check."))
         
         # 4. 
         client_syns = ["Client", "client"]
@@ -204,21 +640,842 @@ def load_oplan_data(file_path="O_Plan_Leads.csv"):
             df = df.rename(columns={actual_client_col: "Client_OPlan"})
             df["Client_OPlan"] = df["Client_OPlan"].fillna("Unknown Client").astype(str).str.strip()
         else:
-            st.warning("Column 'Client' not found in O_Plan_Leads.csv.")
+            notes.append(("warning", "Column 'Client' not found in O_Plan_Leads.csv."))
             df["Client_OPlan"] = "Unknown Client" 
+
+        df = to_categorical(df, OPLAN_CATEGORY_COLS)
             
-        st.success("✅ O Plan file loaded successfully! (Cached for speed)")
-        return df
+        notes.append(("success", "✅ O Plan file loaded successfully! (Cached for speed)"))
+        return df, notes
     except FileNotFoundError:
-        st.error(f"⚠️ خطأ: لم يتم العثور على الملف '{file_path}'. يرجى التأكد من وجود الملف في نفس المجلد.")
-        return pd.DataFrame() # Return empty dataframe on error
+        notes.append(("error", f"⚠️ خطأ: لم يتم العثور على الملف '{file_path}'. يرجى التأكد من وجود الملف في نفس المجلد."))
+        return pd.DataFrame(), notes # Return empty dataframe on error
     except Exception as e:
-        st.error(f"An error occurred while loading O_Plan_Leads.csv: {e}")
-        return pd.DataFrame()
+        notes.append(("error", f"An error occurred while loading O_Plan_Leads.csv: {e}"))
+        return pd.DataFrame(), notes
+
+# ================== FILTER INDEX ==================
+FILTER_DIMENSIONS = ["Client", "Chaser Name", "Chaser Group", "Chasing Disposition"]
+FILTER_DATE_COL = "Created Time"
+
+def filter_key(value):
+    # NaN can't be used as a dict key reliably (nan != nan) -> one shared key for missing values
+    return None if pd.isna(value) else value
+
+def build_day_index(series):
+    """int32 day ordinals (days since 1970-01-01) + the permutation that sorts them. NaT sorts last."""
+    if series.dt.tz is not None:
+        series = series.dt.tz_localize(None)  # keep the local calendar day, like .dt.date
+    day = series.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")
+    valid = ~np.isnat(day)
+    days = np.where(valid, day.astype(np.int64), np.iinfo(np.int32).max).astype(np.int32)
+    order = np.argsort(days, kind="stable").astype(np.int32)
+    return {"days": days, "order": order, "sorted_days": days[order], "n_valid": int(valid.sum())}
+
+@st.cache_resource(show_spinner=False)
+def build_filter_index(_df, dataset_version, columns, date_col=None):
+    """One packed bitset (np.packbits) per value of each sidebar filter column,
+    plus a sorted day index on `date_col` for the date-range filter.
+
+    `_df` is not hashed by Streamlit; `dataset_version` identifies it instead.
+    """
+    index = {"n_rows": len(_df), "dims": {}, "day_index": None}
+    if date_col and date_col in _df.columns:
+        index["day_index"] = build_day_index(_df[date_col])
+    for col in columns:
+        if col not in _df.columns:
+            continue
+        codes, uniques = pd.factorize(_df[col])  # categorical -> reuses its codes
+        bits = {filter_key(v): np.packbits(codes == k) for k, v in enumerate(uniques)}
+        if (codes == -1).any():
+            bits[None] = np.packbits(codes == -1)
+        index["dims"][col] = bits
+    return index
+
+def filter_bits(index, selections, base=None):
+    """AND across dimensions of (OR of the selected values' bitsets).
+
+    `selections` maps column -> selected values. An empty selection or a selection
+    covering every value doesn't restrict that column. Returns packed bits or None (= all rows).
+    """
+    mask = base
+    for col, selected in selections.items():
+        bits = index["dims"].get(col)
+        if bits is None or not selected:
+            continue
+        keys = {filter_key(v) for v in selected}
+        if keys.issuperset(bits):
+            continue
+        dim_mask = np.zeros((index["n_rows"] + 7) // 8, dtype=np.uint8)
+        for k in keys:
+            if k in bits:
+                dim_mask |= bits[k]
+        mask = dim_mask if mask is None else mask & dim_mask
+    return mask
+
+def date_range_bits(index, start_date, end_date):
+    """Rows whose day is within [start_date, end_date] (NaT never matches), as packed bits.
+
+    Two searchsorted calls find the slice of the sorted day index. Returns None when
+    every row is in range.
+    """
+    day_index = index["day_index"]
+    start, end = (np.datetime64(d, "D").astype(np.int64) for d in (start_date, end_date))
+    valid_days = day_index["sorted_days"][:day_index["n_valid"]]
+    lo = np.searchsorted(valid_days, start, side="left")
+    hi = np.searchsorted(valid_days, end, side="right")
+    if lo == 0 and hi == index["n_rows"]:
+        return None
+    rows = np.zeros(index["n_rows"], dtype=bool)
+    rows[day_index["order"][lo:hi]] = True
+    return np.packbits(rows)
+
+def rows_from_bits(index, bits):
+    return np.unpackbits(bits, count=index["n_rows"]).astype(bool)
+
+# ================== MILESTONE CUBE ==================
+# Lead counts pre-aggregated by Created Time day x filter dimensions. KPIs, the
+# Insights Summary and the Disposition/Client distributions sum slices of it.
+CUBE_DIMENSIONS = ["Client", "Chaser Name", "Chaser Group", "Chasing Disposition"]
+CUBE_MILESTONES = [
+    "Created Time (Date)", "Assigned date", "Approval date",
+    "Denial Date", "Completion Date", "Upload Date",
+]
+# Columns offered as "Select column for analysis" on the Data Analysis page
+ANALYSIS_DATE_COLS = [
+    "Created Time (Date)",
+    "Assigned date (Date)",
+    "Approval date (Date)",
+    "Denial Date (Date)",
+    "Completion Date (Date)",
+    "Upload Date (Date)",
+    "Date of Sale (Date)",
+]
+
+CUBE_MEASURES = ["Leads", *CUBE_MILESTONES, "Pending Shipping", "Done"]
+DONE_STATUSES = ["hot lead", "pending shipping", "passed review"]
+
+def milestone_matrix(df):
+    """0/1 int32 matrix (one column per CUBE_MEASURES) of every lead in `df`."""
+    matrix = {"Leads": np.ones(len(df), dtype=np.int32)}
+    for col in CUBE_MILESTONES:
+        matrix[col] = (df[col].notna() if col in df.columns else pd.Series(False, index=df.index)).to_numpy(np.int32)
+    status = df["Chasing Disposition_clean"] if "Chasing Disposition_clean" in df.columns else pd.Series("", index=df.index)
+    matrix["Pending Shipping"] = status.eq("pending shipping").to_numpy(np.int32)
+    matrix["Done"] = status.isin(DONE_STATUSES).to_numpy(np.int32)
+    return pd.DataFrame(matrix, index=df.index)
+
+def aggregate_milestones(counts, by=None):
+    """Every milestone metric in one vectorised grouped sum.
+
+    `counts` holds the CUBE_MEASURES columns, either per lead (milestone_matrix) or
+    already counted (cube slices). `by` is any grouping key (a column name such as
+    Chasing Disposition / Client / Chaser Name / Chaser Group, or an aligned Series
+    such as the O Plan agent); None returns the totals as a Series.
+    Derived metrics ("Not Assigned") are added to the result.
+    """
+    if by is None:
+        metrics = counts[CUBE_MEASURES].sum()
+    else:
+        metrics = counts.groupby(by, observed=True)[CUBE_MEASURES].sum().reset_index()
+    metrics["Not Assigned"] = metrics["Created Time (Date)"] - metrics["Assigned date"]
+    return metrics
+
+@st.cache_resource(show_spinner=False)
+def build_milestone_cube(_df, dataset_version, today):
+    """Counts per (Created Day, Client, Chaser Name, Chaser Group, Chasing Disposition).
+
+    CUBE_MEASURES count all leads; "<analysis col> | <measure>" counts only the leads
+    in the Data Analysis working set for that column (date filled in, not in the future).
+    """
+    keys = {}
+    if FILTER_DATE_COL in _df.columns:
+        keys["Created Day"] = build_day_index(_df[FILTER_DATE_COL])["days"]
+    else:
+        keys["Created Day"] = np.full(len(_df), np.iinfo(np.int32).max, dtype=np.int32)
+    for col in CUBE_DIMENSIONS:
+        keys[col] = _df[col] if col in _df.columns else pd.Series(np.nan, index=_df.index, dtype=object)
+
+    base = {name: values.to_numpy() for name, values in milestone_matrix(_df).items()}
+    measures = dict(base)
+    for analysis_col in ANALYSIS_DATE_COLS:
+        original_col = analysis_col.replace(" (Date)", "")
+        if original_col in _df.columns:
+            in_working_set = (
+                _df[original_col].notna() & ~(_df[original_col].dt.normalize() > today)
+            ).to_numpy(np.int32)
+        else:
+            in_working_set = np.zeros(len(_df), dtype=np.int32)
+        for name, values in base.items():
+            measures[f"{analysis_col} | {name}"] = values * in_working_set
+
+    cube = pd.DataFrame({**keys, **measures}, index=_df.index)
+    return (
+        cube.groupby(list(keys), observed=True, dropna=False, sort=False)
+        .sum()
+        .reset_index()
+    )
+
+def cube_slice(cube, selections, date_range=None, analysis_col=None):
+    """Cube rows matching the sidebar filters (same rules as filter_bits/date_range_bits).
+
+    Returns CUBE_DIMENSIONS + CUBE_MEASURES; with `analysis_col` the measures only
+    count that column's Data Analysis working set.
+    """
+    mask = np.ones(len(cube), dtype=bool)
+    if date_range is not None:
+        start, end = (np.datetime64(d, "D").astype(np.int64) for d in date_range)
+        days = cube["Created Day"].to_numpy()
+        mask &= (days >= start) & (days <= end)  # NaT days (int32 max) never match
+    for col, selected in selections.items():
+        if selected and col in cube.columns:
+            mask &= cube[col].isin(selected).to_numpy()
+
+    measures = CUBE_MEASURES if analysis_col is None else [f"{analysis_col} | {m}" for m in CUBE_MEASURES]
+    sliced = cube.loc[mask, CUBE_DIMENSIONS + measures]
+    sliced.columns = CUBE_DIMENSIONS + CUBE_MEASURES
+    return sliced[sliced["Leads"] > 0]  # cells with no lead in the working set
+
+# ================== JOIN INDEX (Dr Chase ↔ O Plan) ==================
+def group_offsets(counts):
+    """[2, 3] -> [0, 1, 0, 1, 2]: position of every row inside its run."""
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+@st.cache_resource(show_spinner=False)
+def build_mcn_join_index(_left, _right, dataset_version, oplan_version, key="MCN_clean"):
+    """Row positions of every MCN in Dr Chase (left) and O Plan (right), built once per file pair.
+
+    Both sides share one factorisation of the key (norm_series never leaves it missing).
+    Right rows are grouped per key code: right_order[right_starts[c]:][:right_counts[c]].
+    `left_in_right` / `right_in_left` are the both / left-only / right-only flags per row.
+    """
+    codes, uniques = pd.factorize(pd.concat([_left[key], _right[key]], ignore_index=True))
+    left_codes, right_codes = codes[:len(_left)], codes[len(_left):]
+    left_counts = np.bincount(left_codes, minlength=len(uniques))
+    right_counts = np.bincount(right_codes, minlength=len(uniques))
+    key_rank = np.empty(len(uniques), dtype=np.int64)
+    key_rank[np.argsort(uniques.astype(str), kind="stable")] = np.arange(len(uniques))
+    return {
+        "left_index": _left.index,
+        "left_codes": left_codes,
+        "right_codes": right_codes,
+        "right_counts": right_counts,
+        "right_starts": np.cumsum(right_counts) - right_counts,
+        "right_order": np.argsort(right_codes, kind="stable"),
+        "key_rank": key_rank,  # sorted-key order, like an outer merge
+        "left_in_right": right_counts[left_codes] > 0,
+        "right_in_left": left_counts[right_codes] > 0,
+    }
+
+def join_left_positions(index, df):
+    # Rows of a filtered Dr Chase frame -> their positions in the indexed frame
+    return index["left_index"].get_indexer(df.index)
+
+def join_pairs(index, left_pos, right_mask=None):
+    """Inner join of the left rows at `left_pos` -> (take, right positions).
+
+    `take` indexes into `left_pos` (i.e. `df.iloc[take]` for the frame it came from).
+    Pairs come out in SQL order: left order, then O Plan order inside each MCN.
+    `right_mask` (bool per O Plan row) drops O Plan rows before joining.
+    """
+    take = np.flatnonzero(index["left_in_right"][left_pos])
+    codes = index["left_codes"][left_pos[take]]
+    counts = index["right_counts"][codes]
+    right_pos = index["right_order"][np.repeat(index["right_starts"][codes], counts) + group_offsets(counts)]
+    take = np.repeat(take, counts)
+    if right_mask is not None:
+        keep = right_mask[right_pos]
+        take, right_pos = take[keep], right_pos[keep]
+    return take, right_pos
+
+def outer_join_sides(index, left_pos):
+    """Outer join of the left rows at `left_pos` with all of O Plan, split by side.
+
+    -> {"left_only": (take, labels), "right_only": (right positions, labels),
+        "both": (take, right positions, labels)}
+    `labels` are the row labels pd.merge(how="outer") gives (keys sorted, left rows
+    first inside a key) and every side comes back in that order.
+    """
+    key_rank, right_counts = index["key_rank"], index["right_counts"]
+    # Left rows grouped by key order, keeping their order inside a key
+    order = np.argsort(key_rank[index["left_codes"][left_pos]], kind="stable")
+    codes = index["left_codes"][left_pos[order]]
+    ranks = key_rank[codes]
+    left_counts = np.bincount(codes, minlength=len(right_counts))
+    left_ordinal = np.arange(len(codes)) - np.searchsorted(ranks, ranks)
+
+    # Every key present on either side is one block of max(nl, 1) * max(nr, 1) rows
+    sizes = np.where((left_counts > 0) | (right_counts > 0),
+                     np.maximum(left_counts, 1) * np.maximum(right_counts, 1), 0)
+    by_rank = np.argsort(key_rank)
+    block_starts = np.empty(len(sizes), dtype=np.int64)
+    block_starts[by_rank] = np.cumsum(sizes[by_rank]) - sizes[by_rank]
+
+    matched = right_counts[codes] > 0
+    sides = {"left_only": (order[~matched], block_starts[codes[~matched]] + left_ordinal[~matched])}
+
+    right_order = index["right_order"]
+    right_codes = index["right_codes"][right_order]
+    right_ordinal = np.arange(len(right_order)) - index["right_starts"][right_codes]
+    only = left_counts[right_codes] == 0
+    by_key = np.argsort(key_rank[right_codes[only]], kind="stable")
+    sides["right_only"] = (
+        right_order[only][by_key],
+        (block_starts[right_codes] + right_ordinal)[only][by_key],
+    )
+
+    take, right_pos = join_pairs(index, left_pos[order[matched]])
+    counts = right_counts[codes[matched]]
+    labels = (block_starts[codes[matched]].repeat(counts)
+              + left_ordinal[matched].repeat(counts) * counts.repeat(counts)
+              + group_offsets(counts))
+    sides["both"] = (order[matched][take], right_pos, labels)
+    return sides
+
+# ================== LEAD AGING INDEX ==================
+NOT_TOUCHED_SINCE = "2025-10-01"
+NOT_TOUCHED_ASSIGNED_COLS = ["MCN", "Client", "Chaser Name", "Assigned date (Date)", "Chasing Disposition", "Created Time (Date)"]
+NOT_TOUCHED_MODIFIED_COLS = ["MCN", "Client", "Chaser Name", "Modified Time", "Chasing Disposition", "Last Modified By"]
+# Not Touched Leads status groups. Group 1 ⊂ group 2, so a lead is in group g when
+# 1 <= status_group <= g (0 = any other status).
+AGING_STATUS_GROUPS = {
+    1: ["pending dr call", "pending fax", "pending dr visit"],
+    2: ["faxed", "dr chase"],
+}
+AGING_DATE_COLS = {"assigned": "Assigned date", "modified": "Modified Time", "created": "Created Time"}
+
+@st.cache_resource(show_spinner=False)
+def build_aging_index(_df, dataset_version, today):
+    """Whole days since assigned / modified / created (Int16) + status-group code per row.
+
+    Built once per dataset version and day, aligned with _df: "older than N days"
+    is then a single comparison (age > N  <=>  date.normalize() < today - N days).
+    """
+    aging = pd.DataFrame(index=_df.index)
+    for name, col in AGING_DATE_COLS.items():
+        if col in _df.columns:
+            days = (today - _df[col].dt.normalize()).dt.days
+            aging[name] = days.clip(np.iinfo(np.int16).min, np.iinfo(np.int16).max).astype("Int16")
+    status_group = np.zeros(len(_df), dtype=np.int8)
+    if "Chasing Disposition_clean" in _df.columns:
+        for code, statuses in AGING_STATUS_GROUPS.items():
+            status_group[_df["Chasing Disposition_clean"].isin(statuses).to_numpy()] = code
+    aging["status_group"] = status_group
+    if "Completion Date" in _df.columns and "Created Time" in _df.columns:
+        # Still open and created since NOT_TOUCHED_SINCE
+        aging["open_since_start"] = (
+            _df["Completion Date"].isna() & (_df["Created Time"] >= pd.Timestamp(NOT_TOUCHED_SINCE).normalize())
+        )
+    return aging
+
+def aged_over(aging, age, days, group):
+    """Open leads in status group `group` whose `age` is more than `days` days (bool array)."""
+    status_group = aging["status_group"].to_numpy()
+    return (
+        aging["open_since_start"].to_numpy()
+        & (status_group >= 1) & (status_group <= group)
+        & aging[age].gt(days).to_numpy(dtype=bool, na_value=False)
+    )
+
+# ================== DATA QUALITY RULES ==================
+# Each Data Quality Warnings check is declared once: the columns it needs, a vectorised
+# predicate over the Dr Chase frame (+ its aging index), the columns to show and how
+# loudly to report it.
+# build_quality_flags evaluates them all into one bit-flag per row (bit i = rule i);
+# the warnings panel only tests bits and slices rows.
+# "working_set": the rule only counts rows of the Data Analysis working set.
+QUALITY_PENDING_COLS = [
+    "MCN", "Created Time (Date)", "Days Since Created", "Chasing Disposition",
+    "Assigned date (Date)", "Upload Date (Date)", "Completion Date (Date)",
+    "Chaser Name", "Client", "Next Follow-up Date"
+]
+
+def pending_rule(name, days, statuses, display, message, title):
+    """Leads still in one of `statuses` more than `days` days after creation."""
+    return {
+        "name": name, "columns": ["Created Time", "Chasing Disposition_clean"],
+        "predicate": lambda df, aging: (
+            aging["created"].gt(days).to_numpy(dtype=bool, na_value=False)
+            & df["Chasing Disposition_clean"].isin(statuses).to_numpy()
+        ),
+        "display": display, "severity": "warning", "working_set": False,
+        "message": message, "title": title,
+    }
+
+def missing_date_rule(name, present, missing, display, message, title):
+    """Working-set leads where `present` is filled in but `missing` is not."""
+    return {
+        "name": name, "columns": [present, missing],
+        "predicate": lambda df, aging: df[present].notna() & df[missing].isna(),
+        "display": display, "severity": "warning", "working_set": True,
+        "message": message, "title": title,
+    }
+
+DATA_QUALITY_RULES = [
+    {
+        "name": "invalid_sales", "columns": ["Date of Sale", "Created Time"],
+        # Date of Sale is MORE THAN 7 DAYS BEFORE Created Time
+        "predicate": lambda df, aging: df["Date of Sale"].notna() & (
+            df["Date of Sale"].dt.normalize() < df["Created Time"].dt.normalize() - pd.Timedelta(days=7)
+        ),
+        "display": ["MCN", "Client", "Chaser Name", "Created Time (Date)", "Assigned date (Date)", "Date of Sale (Date)"],
+        "severity": "warning", "working_set": False,
+        "message": "leads where **Date of Sale** is more than **7 days BEFORE** Created Time.",
+        "title": "🔍 View Illogical Sale Dates (>7 days before Creation)",
+    },
+    {
+        "name": "pending_shipping", "columns": ["Chasing Disposition_clean", "Upload Date"],
+        "predicate": lambda df, aging: df["Chasing Disposition_clean"].eq("pending shipping") & df["Upload Date"].isna(),
+        "display": [
+            "MCN", "Created Time (Date)", "Assigned date (Date)", "Completion Date (Date)",
+            "Upload Date (Date)", "Chasing Disposition", "Chaser Name", "Client"
+        ],
+        "severity": "warning", "working_set": False,
+        "message": "leads with **Pending Shipping** but missing **Upload Date**.",
+        "title": "🔍 View Pending Shipping Leads Without Upload Date",
+    },
+    pending_rule("pending_fax_call", 5, ["pending fax", "pending dr call"], QUALITY_PENDING_COLS,
+                 "leads pending for more than 5 days (Fax/Dr Call).",
+                 "🔍 View Pending Leads > 5 Days (Fax/Dr Call)"),
+    pending_rule("pending_faxed", 7, ["faxed"], QUALITY_PENDING_COLS,
+                 "leads pending for more than 7 days (Faxed).",
+                 "🔍 View Pending Leads > 7 Days (Faxed)"),
+    pending_rule("pending_dr_chase", 5, ["dr chase"], QUALITY_PENDING_COLS[:-1],
+                 "leads pending for more than 5 days (Dr Chase).",
+                 "🔍 View Pending Leads > 5 Days (Dr Chase)"),
+    missing_date_rule("completion_no_assigned", "Completion Date", "Assigned date",
+                      ["MCN", "Client", "Chaser Name", "Created Time", "Assigned date", "Completion Date"],
+                      "leads with **Completion Date** but no **Assigned date**.",
+                      "🔍 View Leads Missing Assigned Date"),
+    missing_date_rule("completion_no_approval", "Completion Date", "Approval date",
+                      ["MCN", "Client", "Chaser Name", "Created Time", "Approval date", "Completion Date"],
+                      "leads with **Completion Date** but no **Approval date**.",
+                      "🔍 View Leads Missing Approval Date"),
+    missing_date_rule("upload_no_completion", "Upload Date", "Completion Date",
+                      ["MCN", "Client", "Chaser Name", "Upload Date", "Completion Date"],
+                      "leads with **Upload Date** but no **Completion Date**.",
+                      "🔍 View Leads Missing Completion Date after Upload"),
+    missing_date_rule("upload_no_assigned", "Upload Date", "Assigned date",
+                      ["MCN", "Client", "Chaser Name", "Upload Date", "Assigned date"],
+                      "leads with **Upload Date** but no **Assigned date**.",
+                      "🔍 View Leads Missing Assigned Date after Upload"),
+    missing_date_rule("upload_no_approval", "Upload Date", "Approval date",
+                      ["MCN", "Client", "Chaser Name", "Upload Date", "Approval date"],
+                      "leads with **Upload Date** but no **Approval date**.",
+                      "🔍 View Leads Missing Approval Date after Upload"),
+]
+QUALITY_SEVERITY = {"warning": st.warning, "error": st.error}
+
+@st.cache_resource(show_spinner=False)
+def build_quality_flags(_df, _aging, dataset_version, today):
+    """All DATA_QUALITY_RULES in one pass -> (bit flags per row aligned with _df, active rule names).
+
+    Bit i is set when rule i fired. Rules whose columns are missing stay inactive.
+    `today` is part of the cache key only (the ages move every day).
+    """
+    flags = np.zeros(len(_df), dtype=np.uint16)
+    active = []
+    for bit, rule in enumerate(DATA_QUALITY_RULES):
+        if all(c in _df.columns for c in rule["columns"]):
+            flags[np.asarray(rule["predicate"](_df, _aging), dtype=bool)] |= np.uint16(1 << bit)
+            active.append(rule["name"])
+    return pd.Series(flags, index=_df.index, name="Quality Flags"), active
+
+# ================== DATA ANALYSIS SECTIONS (cached) ==================
+# Every section of the Data Analysis page is a pure function of (dataset version,
+# canonical filter state, section parameters). `_df` arguments are not hashed: they are
+# fully determined by the versions + filter_state. Each section keeps its own bounded
+# LRU cache, so changing one section's widget only recomputes that section.
+ANALYSIS_CACHE_ENTRIES = 32
+PERIOD_FREQ = {"Daily": "D", "Weekly": "W", "Monthly": "M"}
+DR_CHASE_CONFLICT_STATUSES = ["dr denied", "rejected by dr chase", "dead lead"]
+OPLAN_CONFLICT_STATUS = "doctor chase"
+
+def canonical_filter_state(index, selections, date_range=None):
+    """Hashable, order-independent form of the sidebar filters (same rows as filter_bits).
+
+    Filters that don't restrict anything (empty, select-all, full date range) are
+    dropped, so equivalent sidebar states share one cache entry.
+    """
+    dims = []
+    for col, selected in selections.items():
+        bits = index["dims"].get(col)
+        if bits is None or not selected:
+            continue
+        keys = {filter_key(v) for v in selected}
+        if keys.issuperset(bits):
+            continue
+        dims.append((col, tuple(sorted(keys & bits.keys(), key=str))))
+    if date_range is not None and (index["day_index"] is None or date_range_bits(index, *date_range) is None):
+        date_range = None
+    return tuple(dims), date_range
+
+def filter_state_selections(filter_state):
+    # filter_key() turned NaN into None; isin() only matches missing values as NaN
+    return {col: [np.nan if k is None else k for k in keys] for col, keys in filter_state[0]}
+
+def working_set_mask(df, original_time_col, today):
+    """Rows of the Data Analysis working set: analysis date filled in and not in the future."""
+    dates = df[original_time_col]
+    return dates.notna() & ~(dates.dt.normalize() > today)
+
+def working_set(df, time_col, today):
+    original_time_col = time_col.replace(" (Date)", "")
+    if original_time_col not in df.columns:
+        return df
+    return df[working_set_mask(df, original_time_col, today)]
+
+@st.cache_data(max_entries=ANALYSIS_CACHE_ENTRIES, show_spinner=False)
+def analysis_time_series(_df, dataset_version, filter_state, time_col, freq, group_by, today):
+    """Lead counts per period (and per `group_by`) over the working set."""
+    df_ts = working_set(_df, time_col, today)
+    keys = [] if group_by == "None" else [group_by]
+    period = df_ts[time_col.replace(" (Date)", "")].dt.to_period(PERIOD_FREQ[freq]).dt.to_timestamp()
+    return (
+        df_ts[keys].assign(Period=period)
+        .groupby(["Period", *keys], observed=True).size()
+        .reset_index(name="Lead Count")
+    )
+
+@st.cache_data(max_entries=ANALYSIS_CACHE_ENTRIES, show_spinner=False)
+def analysis_milestone_metrics(_cube, dataset_version, filter_state, time_col, dim, today):
+    """Milestone counts of the working set per `dim` (read from the milestone cube)."""
+    sliced = cube_slice(_cube, filter_state_selections(filter_state), filter_state[1], time_col)
+    return aggregate_milestones(sliced, dim)
+
+@st.cache_data(max_entries=ANALYSIS_CACHE_ENTRIES, show_spinner=False)
+def analysis_milestone_totals(_cube, dataset_version, filter_state, time_col, today):
+    """Insights Summary totals of the working set (read from the milestone cube)."""
+    sliced = cube_slice(_cube, filter_state_selections(filter_state), filter_state[1], time_col)
+    return aggregate_milestones(sliced)
+
+# Dr. Chase Agents Treemap: grey root / agents, disposition colour by status
+TREEMAP_ROOT = "All Agents"
+TREEMAP_ROOT_COLOR = "#37474F"    # رمادي غامق للجذر
+TREEMAP_CHASER_COLOR = "#546E7A"  # أزرق رمادي للايجنت
+TREEMAP_STATUS_COLORS = {
+    "dead lead": "#EF553B", "dr denied": "#EF553B", "rejected by dr chase": "#EF553B",  # أحمر
+    "pending shipping": "#00CC96", "hot lead": "#00CC96", "passed review": "#00CC96",  # أخضر
+}
+TREEMAP_FAX_COLOR = "#FFA15A"      # برتقالي (any status containing "fax")
+TREEMAP_DEFAULT_COLOR = "#636EFA"  # أزرق
+
+def disposition_colors(statuses):
+    """Treemap colour of every disposition; the rule runs once per distinct value."""
+    codes, uniques = pd.factorize(statuses)
+    lookup = np.array([
+        TREEMAP_STATUS_COLORS.get(s, TREEMAP_FAX_COLOR if "fax" in s else TREEMAP_DEFAULT_COLOR)
+        for s in (str(u).lower().strip() for u in uniques)
+    ] + [TREEMAP_DEFAULT_COLOR], dtype=object)
+    return lookup[codes]  # code -1 (missing) -> last entry
+
+def treemap_nodes(df_tree):
+    """ids / labels / parents / values / colors of the root -> Chaser Name -> Chasing Disposition treemap.
+
+    `df_tree` has one row per (Chaser Name, Chasing Disposition) with its Count.
+    Each level is built with one vectorised operation (no per-chaser filtering).
+    """
+    chasers = df_tree.groupby("Chaser Name", observed=True, sort=False)["Count"].sum()
+    chaser_names = chasers.index.astype(str)
+    statuses = df_tree["Chasing Disposition"].astype(str)
+    leaf_parents = TREEMAP_ROOT + "/" + df_tree["Chaser Name"].astype(str)
+    return {
+        "ids": [TREEMAP_ROOT, *(TREEMAP_ROOT + "/" + chaser_names), *(leaf_parents + "/" + statuses)],
+        "labels": [TREEMAP_ROOT, *chaser_names, *statuses],
+        "parents": ["", *[TREEMAP_ROOT] * len(chasers), *leaf_parents],
+        "values": [df_tree["Count"].sum(), *chasers.to_numpy(), *df_tree["Count"].to_numpy()],
+        "colors": [TREEMAP_ROOT_COLOR, *[TREEMAP_CHASER_COLOR] * len(chasers),
+                   *disposition_colors(df_tree["Chasing Disposition"])],
+    }
+
+@st.cache_data(max_entries=ANALYSIS_CACHE_ENTRIES, show_spinner=False)
+def analysis_treemap_figure(_df, dataset_version, filter_state):
+    """Dr. Chase Agents Treemap figure (lead counts per Chaser Name -> Chasing Disposition)."""
+    df_tree = _df.groupby(['Chaser Name', 'Chasing Disposition'], observed=True).size().reset_index(name='Count')
+    nodes = treemap_nodes(df_tree[df_tree['Count'] > 0])
+    fig_tree = go.Figure(go.Treemap(
+        ids=nodes["ids"],
+        labels=nodes["labels"],
+        parents=nodes["parents"],
+        values=nodes["values"],
+        marker=dict(
+            colors=nodes["colors"],
+            line=dict(width=1, color='black') # حدود سوداء خفيفة
+        ),
+        branchvalues="total",
+        textinfo="label+value+percent parent",
+        textfont=dict(size=14)
+    ))
+    fig_tree.update_layout(
+        template="plotly_dark",
+        margin=dict(t=50, l=10, r=10, b=10),
+        height=600,
+        title="Hierarchical View: All Agents (Grey) ➡️ Status (Colored)"
+    )
+    return fig_tree
+
+@st.cache_data(max_entries=ANALYSIS_CACHE_ENTRIES, show_spinner=False)
+def analysis_data_quality(_df, _oplan, _join_index, _quality_flags, dataset_version, oplan_version, filter_state, time_col, today):
+    """Rows flagged by the Data Quality Warnings checks -> {check: row positions in _df}.
+
+    Reads the precomputed rule bits; a check is missing from the result when its
+    columns are not in the data. "conflicting_leads" -> (row positions, O Plan positions).
+    Only positions are kept: the tables are built when a section is opened.
+    """
+    flags, active = _quality_flags
+    flags = flags.loc[_df.index].to_numpy()
+    original_time_col = time_col.replace(" (Date)", "")
+    if original_time_col in _df.columns:
+        in_working_set = working_set_mask(_df, original_time_col, today).to_numpy()
+    else:
+        in_working_set = np.ones(len(_df), dtype=bool)
+
+    checks = {}
+    for bit, rule in enumerate(DATA_QUALITY_RULES):
+        if rule["name"] not in active:
+            continue
+        hit = (flags & np.uint16(1 << bit)) != 0
+        if rule["working_set"]:
+            hit &= in_working_set
+        checks[rule["name"]] = np.flatnonzero(hit)
+
+    # Denied/Dead in Dr. Chase but "doctor chase" in O Plan
+    if (_join_index is not None and
+        "Closing Status_clean" in _oplan.columns and
+        "Chasing Disposition_clean" in _df.columns):
+        candidates = np.flatnonzero(_df["Chasing Disposition_clean"].isin(DR_CHASE_CONFLICT_STATUSES).to_numpy())
+        take, oplan_pos = join_pairs(
+            _join_index, join_left_positions(_join_index, _df)[candidates],
+            right_mask=_oplan["Closing Status_clean"].eq(OPLAN_CONFLICT_STATUS).to_numpy()
+        )
+        checks["conflicting_leads"] = (candidates[take], oplan_pos)
+    return checks
+
+def conflict_rows(df, oplan, positions, oplan_pos):
+    """Conflicting leads table: the Dr Chase rows next to their O Plan closing status."""
+    return df.iloc[positions][["MCN_clean", "Chasing Disposition", "Chaser Name", "Client"]].reset_index(drop=True).assign(
+        **{"Closing Status_clean": oplan["Closing Status_clean"].array[oplan_pos]}
+    )
+
+LEAD_AGE_SOURCE_COLS = ["Created Time", "Approval date", "Denial Date", "Chaser Name", "Client"]
+LEAD_AGE_TABLE_COLS = [
+    "Created Time (Date)", "Approval date", "Denial Date", "Lead Age (Approval)",
+    "Lead Age (Denial)", "Chaser Name", "Client", "MCN"
+]
+
+def lead_age_frame(df):
+    """Copy of `df` with Lead Age (Approval / Denial) = whole days from Created Time.
+
+    Always float (NaN when the date is missing), also for row subsets without gaps.
+    """
+    df = df.copy()
+    if "Approval date" in df.columns:
+        df["Lead Age (Approval)"] = (df["Approval date"] - df["Created Time"]).dt.days.astype("float64")
+    if "Denial Date" in df.columns:
+        df["Lead Age (Denial)"] = (df["Denial Date"] - df["Created Time"]).dt.days.astype("float64")
+    return df
+
+def lead_age_stats(df_lead_age, dim):
+    """Mean / median / p90 / count of the Week 0+ lead ages per `dim` and Approval/Denial.
+
+    One row per (dim, Type); groups without a positive age are left out.
+    """
+    stats = []
+    for age_col in ["Lead Age (Approval)", "Lead Age (Denial)"]:
+        ages = df_lead_age[age_col]
+        grouped = ages.where(ages >= 0).groupby(df_lead_age[dim], observed=True)
+        stats.append(pd.DataFrame({
+            "Type": age_col,
+            "Mean": grouped.mean(),
+            "Median": grouped.median(),
+            "P90": grouped.quantile(0.9),
+            "Count": grouped.count(),
+        }))
+    stats = pd.concat(stats).rename_axis(dim).reset_index()
+    return stats[stats["Count"] > 0]
+
+@st.cache_data(max_entries=ANALYSIS_CACHE_ENTRIES, show_spinner=False)
+def analysis_lead_age(_df, dataset_version, filter_state, time_col, today):
+    """Lead Age Analysis (days from Created Time to Approval / Denial) of the working set.
+
+    Detail tables are returned as row positions in _df (see lead_age_rows).
+    """
+    df_ws = working_set(_df, time_col, today)
+    df_lead_age = lead_age_frame(df_ws[[c for c in LEAD_AGE_SOURCE_COLS if c in df_ws.columns]])
+
+    # Mean/median only over positive ages (Week 0+)
+    positive_approval_ages = df_lead_age[df_lead_age["Lead Age (Approval)"] >= 0]["Lead Age (Approval)"]
+    positive_denial_ages = df_lead_age[df_lead_age["Lead Age (Denial)"] >= 0]["Lead Age (Denial)"]
+    age = {
+        "total_approved": positive_approval_ages.notna().sum(),
+        "total_denied": positive_denial_ages.notna().sum(),
+        "avg_approval_age": positive_approval_ages.mean(skipna=True),
+        "avg_denial_age": positive_denial_ages.mean(skipna=True),
+    }
+
+    table_pos = _df.index.get_indexer(df_lead_age.index)
+    age["table"] = table_pos
+    age["both_dates"] = table_pos[(df_lead_age["Approval date"].notna() & df_lead_age["Denial Date"].notna()).to_numpy()]
+
+    for kind in ["Approval", "Denial"]:
+        age_col, week_col = f"Lead Age ({kind})", f"{kind} Week"
+        if age_col not in df_lead_age.columns:
+            continue
+        df_lead_age[week_col] = week_buckets(df_lead_age[age_col])
+        summary_all = df_lead_age[week_col].value_counts().sort_index().reset_index()
+        summary_all.columns = ["Week", "Count"]
+        age[f"{kind.lower()}_summary"] = summary_all
+        age[f"negative_{kind.lower()}"] = table_pos[df_lead_age[week_col].lt(0).to_numpy(dtype=bool, na_value=False)]
+
+    # Approval vs Denial per Chaser / Client, positive ages only
+    for dim in ["Chaser Name", "Client"]:
+        if dim in df_lead_age.columns:
+            age[f"grouped_{dim}"] = lead_age_stats(df_lead_age, dim)
+    return age
+
+def lead_age_rows(df, positions, columns):
+    """Lead age detail rows at `positions`; ages / week categories computed for those rows only."""
+    rows = lead_age_frame(df.iloc[positions])
+    for kind in ["Approval", "Denial"]:
+        if f"Lead Age ({kind})" in rows.columns:
+            rows[f"{kind} Category"] = week_labels(week_buckets(rows[f"Lead Age ({kind})"]))
+    return rows[[c for c in columns if c in rows.columns]]
+
+@st.cache_data(max_entries=ANALYSIS_CACHE_ENTRIES, show_spinner=False)
+def analysis_not_touched(_df, _aging, dataset_version, filter_state, today, days=7):
+    """Open leads created since NOT_TOUCHED_SINCE that nobody worked on recently -> row positions.
+
+    `days` is the threshold of the assigned / modified checks; the critical one stays at 14.
+    """
+    aging = _aging.loc[_df.index]
+    return {
+        # Assigned > `days` days ago (Group 1 statuses)
+        "assigned_over": np.flatnonzero(aged_over(aging, "assigned", days, 1)),
+        # Last modified > `days` days ago (Group 2 statuses)
+        "modified_over": np.flatnonzero(aged_over(aging, "modified", days, 2)),
+        # Assigned > 14 days ago (Group 2 statuses - critical)
+        "assigned_over_14": np.flatnonzero(aged_over(aging, "assigned", 14, 2)),
+    }
+
+DUP_SAME_PRODUCT_COLS = ["MCN", "Products", "Created Time", "Date of Sale", "Dr Name", "Client", "Chaser Name", "Chasing Disposition"]
+DUP_DIFF_PRODUCT_COLS = [
+    "MCN","Products","Chaser Name","Chaser Group","Date of Sale (Date)","Created Time (Date)",
+    "Assigned date (Date)","Approval date (Date)","Denial Date (Date)",
+    "Completion Date (Date)","Upload Date (Date)","Client",
+    "Chasing Disposition","Insurance","Type Of Sale"
+]
+
+@st.cache_resource(show_spinner=False)
+def build_duplicate_index(_df, dataset_version):
+    """duplicate_index() over MCN × Products of the whole Dr Chase frame, once per dataset version."""
+    return {**duplicate_index(_df, "MCN", "Products"), "labels": _df.index}
+
+@st.cache_data(max_entries=ANALYSIS_CACHE_ENTRIES, show_spinner=False)
+def analysis_duplicates(_df, _dup_index, dataset_version, filter_state):
+    """MCNs duplicated with the same Product, and MCNs with several different Products.
+
+    Reads the (MCN, Products) group ids of the duplicate index for the filtered rows;
+    the tables are returned as row positions in _df, already in display order.
+    """
+    same_product, diff_product = duplicate_masks(_dup_index, _dup_index["labels"].get_indexer(_df.index))
+
+    def sorted_positions(mask, by):
+        positions = np.flatnonzero(mask)
+        order = _df[by].iloc[positions].reset_index(drop=True).sort_values(by).index.to_numpy()
+        return positions[order]
+
+    return {
+        "same_product": sorted_positions(same_product, ["MCN", "Products", "Created Time"]),
+        "same_product_mcns": _df["MCN"][same_product].nunique(),
+        "diff_product": sorted_positions(diff_product, ["MCN", "Products"]),
+        "diff_product_mcns": _df["MCN"][diff_product].nunique(),
+    }
+
+@st.cache_data(max_entries=ANALYSIS_CACHE_ENTRIES, show_spinner=False)
+def analysis_agent_performance(_df, _oplan, _join_index, dataset_version, oplan_version, filter_state, time_col, today):
+    """Working set joined with the O Plan agents -> Total / Done leads and Done Rate per agent."""
+    df_ts = working_set(_df, time_col, today)
+    take, oplan_pos = join_pairs(_join_index, join_left_positions(_join_index, df_ts))
+    df_merged_analysis = pd.DataFrame({
+        "Chasing Disposition_clean": df_ts["Chasing Disposition_clean"].array[take],
+        "Assign To_clean": _oplan["Assign To_clean"].array[oplan_pos],
+    })
+    agent_performance = aggregate_milestones(
+        milestone_matrix(df_merged_analysis), df_merged_analysis["Assign To_clean"]
+    ).rename(columns={"Leads": "Total_Leads", "Done": "Done_Leads"})
+    agent_performance = agent_performance[["Assign To_clean", "Total_Leads", "Done_Leads"]]
+    agent_performance['Done Rate'] = (agent_performance['Done_Leads'] / agent_performance['Total_Leads']).fillna(0) * 100
+    return agent_performance
+
+@st.cache_data(max_entries=ANALYSIS_CACHE_ENTRIES, show_spinner=False)
+def analysis_difference_leads(_df, _join_index, dataset_version, oplan_version, filter_state, time_col, today):
+    """Working set vs O Plan by MCN_clean -> row positions of (Dr Chase only, O Plan only, both).
+
+    Every side is (positions, labels): rows of `_df` (of O Plan for "oplan_only") and
+    the row labels pd.merge(how="outer") gives them. Tables are built from these when shown.
+    """
+    original_time_col = time_col.replace(" (Date)", "")
+    left_pos = join_left_positions(_join_index, _df)
+    if original_time_col in _df.columns:
+        working_rows = np.flatnonzero(working_set_mask(_df, original_time_col, today))
+    else:
+        working_rows = np.arange(len(_df))
+    sides = outer_join_sides(_join_index, left_pos[working_rows])
+    take, labels = sides["left_only"]
+    chase_only = (working_rows[take], labels)
+    oplan_only = sides["right_only"]
+    take, _, labels = sides["both"]
+    matched = (working_rows[take], labels)
+    return {"chase_only": chase_only, "oplan_only": oplan_only, "both": matched}
+
+def difference_rows(df, positions, labels, columns=None):
+    """Difference leads table: rows at `positions`, labelled like the outer merge."""
+    rows = df.iloc[positions]
+    return (rows if columns is None else rows[columns]).set_axis(labels)
+
+def matched_rows(df, positions, labels, time_col, freq):
+    """"Both Files" table: the full working-set rows, including their aggregation Period."""
+    rows = difference_rows(df, positions, labels)
+    period = rows[time_col.replace(" (Date)", "")].dt.to_period(PERIOD_FREQ[freq]).dt.to_timestamp()
+    return rows.assign(Period=period)
 
 # ================== EXECUTE DATA LOAD ==================
-df_cleaned = load_and_clean_data(df_raw, name_map, cols_map, samy_chasers)
-df_oplan = load_oplan_data("O_Plan_Leads.csv") # 🆕 Load O Plan data
+OPLAN_FILE = "O_Plan_Leads.csv"
+
+# ⚡ Both files load at the same time. Threads (not processes): read_csv's C parser and
+# the Parquet reader release the GIL, and the frames stay in st.cache_resource without pickling.
+# The workers get this run's script context (the caches need it) but render nothing:
+# the spinner and the loaders' notes are shown from this thread once both are done.
+load_start = time.perf_counter()
+with st.spinner("Loading Dr Chase leads..."):
+    with ThreadPoolExecutor(max_workers=2, initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx())) as pool:
+        dr_chase_job = pool.submit(
+            load_dr_chase_data, DR_CHASE_FILE, dr_chase_stat, name_map, cols_map, samy_chasers,
+            today=pd.Timestamp.now().normalize()
+        )
+        oplan_job = pool.submit(load_oplan_data, OPLAN_FILE) # 🆕 Load O Plan data
+        df_cleaned, dr_chase_notes = dr_chase_job.result()
+        df_oplan, oplan_notes = oplan_job.result()
+# Wall clock of this run's load; None when both came from the cache (nothing was loaded)
+load_seconds = time.perf_counter() - load_start if loaders_ran else None
+for level, message in dr_chase_notes + oplan_notes:
+    getattr(st, level)(message)
+# Identifies the loaded Dr Chase data for cached structures built on top of it
+dataset_version = (DR_CHASE_FILE, dr_chase_stat, config_fingerprint(name_map, samy_chasers, cols_map))
+filter_index = build_filter_index(df_cleaned, dataset_version, FILTER_DIMENSIONS, FILTER_DATE_COL)
+milestone_cube = build_milestone_cube(df_cleaned, dataset_version, today=pd.Timestamp.now().normalize())
+try:
+    oplan_stat = os.stat(OPLAN_FILE)
+    oplan_version = (OPLAN_FILE, oplan_stat.st_size, oplan_stat.st_mtime_ns)
+except FileNotFoundError:
+    oplan_version = (OPLAN_FILE, None)
+aging_index = build_aging_index(df_cleaned, dataset_version, today=pd.Timestamp.now().normalize())
+quality_flags = build_quality_flags(df_cleaned, aging_index, dataset_version, today=pd.Timestamp.now().normalize())
+# MCN -> rows in both files; conflict check, Agent Performance and Difference leads gather through it
+if not df_oplan.empty and "MCN_clean" in df_cleaned.columns and "MCN_clean" in df_oplan.columns:
+    mcn_join_index = build_mcn_join_index(df_cleaned, df_oplan, dataset_version, oplan_version)
+else:
+    mcn_join_index = None
 
 
 # ================== COLUMN DESCRIPTIONS ==================
@@ -288,6 +1545,98 @@ with st.sidebar:
         default_index=0,
         orientation="vertical"
     )
+    if load_seconds is not None:
+        st.caption(f"⏱️ {' + '.join(sorted(loaders_ran))} loaded in {load_seconds:.2f}s")
+
+# --- Paginated table (only the visible page is sent to the browser) ---
+TABLE_PAGE_SIZES = [25, 50, 100, 250, 500]
+TABLE_DEFAULT_PAGE_SIZE = 100
+
+# (Time) columns are stored as seconds since midnight -> format only what is shown
+def format_time_columns(view):
+    time_cols = [c for c in view.columns if c.endswith(" (Time)")]
+    if time_cols:
+        view = view.copy()
+        for c in time_cols:
+            view[c] = (pd.Timestamp(0) + pd.to_timedelta(view[c].astype("float64"), unit="s")).dt.strftime("%H:%M:%S")
+    return view
+
+def date_column_config(columns):
+    """(Date) columns hold midnight timestamps -> show them as plain dates."""
+    return {c: st.column_config.DateColumn(c, format="DD/MM/YYYY") for c in columns if c.endswith(" (Date)")}
+
+def paged_dataframe(df, key, column_config=None, prepare=format_time_columns, rows=None, columns=None):
+    """st.dataframe over one page of `df`, sorted and sliced on the server.
+
+    `rows` (positions) / `columns` select what the table holds without copying it:
+    only the visible page is materialised. Sort column, order, page size and page
+    number live in st.session_state under `key`; `prepare` (display formatting, by
+    default the (Time) columns) only runs on the rows that are shown, and (Date) columns
+    are shown as dates. The full table is only serialised on download.
+    """
+    prepare = prepare or (lambda frame: frame)
+    rows = np.arange(len(df)) if rows is None else np.asarray(rows)
+    columns = list(df.columns) if columns is None else [c for c in columns if c in df.columns]
+    column_config = {**date_column_config(columns), **(column_config or {})}
+    if len(rows) <= TABLE_PAGE_SIZES[0]:
+        st.dataframe(prepare(df.iloc[rows][columns]), column_config=column_config, use_container_width=True)
+        return
+
+    # Widgets whose options depend on the data get a new identity when the data changes,
+    # so the chosen sort column / page are also kept under `key` and restored from there.
+    state = st.session_state.setdefault(f"{key}_state", {"sort_by": "(file order)", "page": 1})
+    sort_col, order_col, size_col, page_col = st.columns([3, 2, 2, 2])
+    sort_options = ["(file order)", *columns]
+    sort_by = sort_col.selectbox(
+        "Sort by:", sort_options,
+        index=sort_options.index(state["sort_by"]) if state["sort_by"] in sort_options else 0,
+        key=f"{key}_sort"
+    )
+    descending = order_col.radio("Order:", ["Asc", "Desc"], horizontal=True, key=f"{key}_order") == "Desc"
+    page_size = size_col.selectbox(
+        "Rows per page:", TABLE_PAGE_SIZES, index=TABLE_PAGE_SIZES.index(TABLE_DEFAULT_PAGE_SIZE), key=f"{key}_page_size"
+    )
+    n_pages = -(-len(rows) // page_size)
+    page = page_col.number_input(
+        f"Page (of {n_pages:,}):", min_value=1, max_value=n_pages, step=1,
+        value=min(state["page"], n_pages), key=f"{key}_page"
+    )
+    state.update(sort_by=sort_by, page=page)
+
+    if sort_by == "(file order)":
+        order = np.arange(len(rows))
+        if descending:
+            order = order[::-1]
+    else:
+        order = (
+            df[sort_by].iloc[rows].reset_index(drop=True)
+            .sort_values(ascending=not descending, kind="stable", na_position="last")
+            .index.to_numpy()
+        )
+    start = (page - 1) * page_size
+    st.dataframe(
+        prepare(df.iloc[rows[order[start:start + page_size]]][columns]),
+        column_config=column_config,
+        use_container_width=True
+    )
+    st.caption(f"Rows {start + 1:,}–{min(start + page_size, len(rows)):,} of {len(rows):,}")
+    if st.button("⬇️ Prepare full download (CSV)", key=f"{key}_export"):
+        st.download_button(
+            label="Download CSV",
+            data=prepare(df.iloc[rows][columns]).to_csv(index=False).encode("utf-8"),
+            file_name=f"{key}.csv",
+            mime="text/csv",
+            key=f"{key}_download",
+        )
+
+def lazy_section(title, key):
+    """Collapsed section that is only computed once the user opens it.
+
+    st.expander always runs its body; this is a toggle (state kept in
+    st.session_state[key]) and the caller renders the details only while it is on,
+    so a section nobody opened costs one widget per rerun.
+    """
+    return st.toggle(title, key=key)
 
 # --- Function for tabular view (USED IN BOTH TABS) ---
 def table(df_filtered):
@@ -304,7 +1653,181 @@ def table(df_filtered):
             df_filtered.columns.tolist(),
             default=shwdata_defaults
         )
-        st.dataframe(df_filtered[shwdata], use_container_width=True)
+        paged_dataframe(df_filtered, key="tabular_view", columns=shwdata)
+
+
+# ================== DATA ANALYSIS FRAGMENTS ==================
+# Each fragment owns its widgets: changing one of them reruns only that function (with
+# the arguments of the last full run), not APP.py. Arguments are the shared cached inputs.
+MILESTONE_METRICS = {
+    "Total Leads (with Created Time (Date))": "Created Time (Date)",
+    "Total Assigned": "Assigned date",
+    "Not Assigned": "Not Assigned",
+    "Total Approved": "Approval date",
+    "Total Denied": "Denial Date",
+    "Total Completed": "Completion Date",
+    "Total Uploaded": "Upload Date"
+}
+
+@st.experimental_fragment
+def time_series_fragment(df_filtered, dataset_version, filter_state, time_col, today):
+    """Aggregation level / Break down by -> historical time series and top performers."""
+    # --- Aggregation frequency (also read by Difference leads from st.session_state) ---
+    freq = st.radio(
+        "Aggregation level:", ["Daily", "Weekly", "Monthly"], horizontal=True, key="aggregation_level",
+        on_change=lambda: st.session_state.update(aggregation_level_changed=True)
+    )
+    # The open "Both Files" table shows Period at this level: a fragment-only run would
+    # leave it stale -> redraw the whole page (a full run redraws it anyway)
+    if (st.session_state.pop("aggregation_level_changed", False) and st.session_state.get("matched_leads_open")
+            and get_script_run_ctx().fragment_ids_this_run):
+        st.rerun()
+
+    # --- Grouping option ---
+    group_by = st.selectbox("Break down by:", ["None", "Client", "Chaser Name", "Chaser Group"])
+    ts_data = analysis_time_series(df_filtered, dataset_version, filter_state, time_col, freq, group_by, today)
+    if ts_data.empty:
+        return
+
+    # 📈 Historical Time Series
+    st.subheader("📈 Historical Time Series")
+
+    if group_by == "None":
+        chart = (
+            alt.Chart(ts_data)
+            .mark_line(point=True, color="#007bff")
+            .encode(x="Period:T", y="Lead Count", tooltip=["Period:T", "Lead Count"])
+            .properties(height=400)
+        )
+    else:
+        chart = (
+            alt.Chart(ts_data)
+            .mark_line(point=True)
+            .encode(
+                x="Period:T",
+                y="Lead Count",
+                color=f"{group_by}:N",
+                tooltip=["Period:T", "Lead Count", group_by]
+            )
+            .properties(height=400)
+        )
+    st.altair_chart(chart, use_container_width=True)
+
+    # 🏆 Top performers
+    if group_by in ["Chaser Name", "Client"]:
+        st.subheader(f"🏆 Top {group_by}s by Leads")
+        top_table = ts_data.groupby(group_by, observed=True)["Lead Count"].sum().reset_index()
+        top_table = top_table.sort_values("Lead Count", ascending=False).head(40)
+        st.table(top_table)
+
+@st.experimental_fragment
+def milestone_distribution_fragment(cube, dataset_version, filter_state, time_col, today, dim, key):
+    """Metric selectbox -> total + bar chart of one milestone per `dim` (Chasing Disposition / Client)."""
+    metric_option = st.selectbox(f"Select metric to display by {dim}:", list(MILESTONE_METRICS), key=key)
+    metrics_by_dim = analysis_milestone_metrics(cube, dataset_version, filter_state, time_col, dim, today)
+
+    selected_col = MILESTONE_METRICS[metric_option]
+    chart_data = metrics_by_dim[[dim, selected_col]].rename(columns={selected_col: "Count"})
+
+    total_selected_metric = chart_data["Count"].sum()
+
+    col_metric, col_spacer = st.columns([1, 4])
+    with col_metric:
+        st.metric(label=f"Total Count for: {metric_option}", value=f"{total_selected_metric:,}")
+
+    if total_selected_metric > 0:
+        chart_data["Percentage"] = (chart_data["Count"] / total_selected_metric * 100).round(1)
+    else:
+        chart_data["Percentage"] = 0.0
+    chart_data["Label"] = chart_data["Count"].apply(lambda x: f'{x:,}')
+
+    chart_dim = (
+        alt.Chart(chart_data)
+        .mark_bar()
+        .encode(
+            x=alt.X(dim, sort="-y", title=dim),
+            y=alt.Y("Count", title=selected_col.replace(" (Date)", "")),
+            color=f"{dim}:N",
+            tooltip=[dim, "Count", alt.Tooltip("Percentage", format=".1f", title="Percentage (%)")]
+        )
+        .properties(height=400)
+    )
+
+    text = chart_dim.mark_text(
+        align='center',
+        baseline='bottom',
+        dy=-5,
+        color='white',
+        fontSize=12
+    ).encode(
+        text=alt.Text("Label")
+    )
+
+    st.altair_chart(chart_dim + text, use_container_width=True)
+
+@st.experimental_fragment
+def not_touched_fragment(df_filtered, aging_index, dataset_version, filter_state, today):
+    """Not touched threshold slider -> the three Not Touched Leads groups."""
+    not_touched_days = st.slider(
+        "Not touched for more than (days):", min_value=1, max_value=60, value=7, key="not_touched_days"
+    )
+    not_touched = analysis_not_touched(
+        df_filtered, aging_index, dataset_version, filter_state, today, not_touched_days
+    )
+
+    # 1. Leads Assigned > N Days ago (Group 1 Statuses)
+    leads_assigned_over = not_touched["assigned_over"]
+    if len(leads_assigned_over):
+        st.warning(f"⚠️ Found **{len(leads_assigned_over)}** active leads assigned > **{not_touched_days} days** ago (Pending Call/Fax/Visit).")
+        if lazy_section(f"🔍 View Leads (Assigned > {not_touched_days} Days - Group 1)", key="not_touched_assign_open"):
+            paged_dataframe(df_filtered, key="not_touched_assign", rows=leads_assigned_over, columns=NOT_TOUCHED_ASSIGNED_COLS)
+
+    # 2. Leads Last Modified > N Days ago (Group 2 Statuses)
+    leads_modified_over = not_touched["modified_over"]
+    if len(leads_modified_over):
+        st.warning(f"⚠️ Found **{len(leads_modified_over)}** active leads not modified for > **{not_touched_days} days**.")
+        if lazy_section(f"🔍 View  Leads (Last Modified > {not_touched_days} Days - Group 2)", key="not_touched_mod_open"):
+            paged_dataframe(df_filtered, key="not_touched_mod", rows=leads_modified_over, columns=NOT_TOUCHED_MODIFIED_COLS)
+
+    # 3. Leads Assigned > 14 Days ago (Group 2 Statuses - Critical)
+    leads_assigned_over_14 = not_touched["assigned_over_14"]
+    if len(leads_assigned_over_14):
+        st.error(f"🚨 Found **{len(leads_assigned_over_14)}** active leads assigned > **14 days** ago !")
+        if lazy_section("🔍 View Leads (Assigned > 14 Days - Group 2)", key="not_touched_assign_14_open"):
+            paged_dataframe(df_filtered, key="not_touched_assign_14", rows=leads_assigned_over_14, columns=NOT_TOUCHED_ASSIGNED_COLS)
+
+@st.experimental_fragment
+def agent_kpi_fragment(agent_performance):
+    """O Plan agent selectbox -> KPI cards of that agent (or all agents)."""
+    agent_list = sorted(agent_performance["Assign To_clean"])
+    kpi_agent = st.selectbox("Select O Plan Agent for KPIs:", ["All Agents"] + agent_list, key="kpi_agent_select")
+
+    # Filter for the selected agent (rows of the per-agent table)
+    if kpi_agent == "All Agents":
+        df_kpi_data = agent_performance
+        kpi_title = "All Agents"
+    else:
+        df_kpi_data = agent_performance[agent_performance["Assign To_clean"] == kpi_agent]
+        kpi_title = kpi_agent
+
+    # Calculate KPIs
+    total_leads_for_agent = df_kpi_data['Total_Leads'].sum()
+    total_done = df_kpi_data['Done_Leads'].sum()
+    pct_done = (total_done / total_leads_for_agent * 100) if total_leads_for_agent > 0 else 0
+
+    # Show KPIs
+    kpi_col1, kpi_col2, kpi_col3 = st.columns(3)
+    kpi_col1.metric(f"Total Leads for {kpi_title}", total_leads_for_agent)
+    kpi_col2.metric(f"'Done' Leads (Hot, Pending, Passed)", total_done)
+    kpi_col3.metric(f"'Done' Rate", f"{pct_done:.1f}%")
+
+    # (FIXED)
+    style_metric_cards(
+        background_color="#0E1117",
+        border_left_color="#FF4B4B",
+        border_color="#444",
+        box_shadow="2px 2px 10px rgba(0,0,0,0.5)"
+    )
 
 
 # ================== SIDEBAR FILTERS ==================
@@ -404,50 +1927,25 @@ with st.sidebar.expander("📅 Date Range", expanded=False):
         date_range = (default_date, default_date)
 
 
-# --- Apply filters using .query() ---
-# 🆕 (FIXED) 1. 
-query_parts_kpi = []
-if Client and "Client" in df_cleaned.columns:
-    query_parts_kpi.append("Client in @Client")
-if Chaser_Name and "Chaser Name" in df_cleaned.columns:
-    query_parts_kpi.append("`Chaser Name` in @Chaser_Name")
-if Chaser_Group and "Chaser Group" in df_cleaned.columns:
-    query_parts_kpi.append("`Chaser Group` in @Chaser_Group")
-
-# 🆕 (FIXED) 2. 
-if query_parts_kpi:
-    final_query_kpi = " and ".join(query_parts_kpi)
-    df_kpi = df_cleaned.query(final_query_kpi)
-else:
-    df_kpi = df_cleaned.copy()
+# --- Apply filters using the precomputed filter index ---
+# Date filter (on Created Time by default) applies to both views
+date_bits = None
+active_date_range = None
+if isinstance(date_range, tuple) and len(date_range) == 2 and filter_index["day_index"] is not None:
+    start_date, end_date = date_range
+    active_date_range = (start_date, end_date)
+    date_bits = date_range_bits(filter_index, start_date, end_date)
 
-# 🆕 (FIXED) 3. 
-query_parts_main = query_parts_kpi.copy() # 
-if Chasing_Disposition and "Chasing Disposition" in df_cleaned.columns:
-    query_parts_main.append("`Chasing Disposition` in @Chasing_Disposition") # 
+kpi_selections = {"Client": Client, "Chaser Name": Chaser_Name, "Chaser Group": Chaser_Group}
+main_selections = {**kpi_selections, "Chasing Disposition": Chasing_Disposition}
 
-# 🆕 (FIXED) 4. 
-if query_parts_main:
-    final_query_main = " and ".join(query_parts_main)
-    df_filtered = df_cleaned.query(final_query_main)
-else:
-    df_filtered = df_kpi.copy() # 
-    
+# KPIs ignore the Chasing Disposition filter; the main view adds it on top of the same bits
+kpi_bits = filter_bits(filter_index, kpi_selections, base=date_bits)
+main_bits = filter_bits(filter_index, {"Chasing Disposition": Chasing_Disposition}, base=kpi_bits)
+
+# No filter -> the cleaned frame itself (the page only reads it)
+df_filtered = df_cleaned if main_bits is None else df_cleaned[rows_from_bits(filter_index, main_bits)]
 
-# Apply date filter (on Created Time by default)
-if isinstance(date_range, tuple) and len(date_range) == 2:
-    start_date, end_date = date_range
-    if "Created Time" in df_filtered.columns:
-        # 
-        df_filtered = df_filtered[
-            (df_filtered["Created Time"].dt.date >= start_date)
-            & (df_filtered["Created Time"].dt.date <= end_date)
-        ]
-        # 🆕 (FIX) 
-        df_kpi = df_kpi[
-            (df_kpi["Created Time"].dt.date >= start_date)
-            & (df_kpi["Created Time"].dt.date <= end_date)
-        ]
 # ================== MAIN DASHBOARD (Dataset Overview) ==================
 if selected == "Dataset Overview":
     st.title("📋 Dataset Overview – General Inspection")
@@ -463,19 +1961,15 @@ if selected == "Dataset Overview":
     st.subheader("📌 Key Performance Indicators")
     
     # --- حساب القيم ---
-    # 🆕 (FIXED) 
-    total_leads = len(df_kpi)
-    total_completed = df_kpi["Completion Date"].notna().sum() if "Completion Date" in df_kpi.columns else 0
-    total_assigned = df_kpi["Assigned date"].notna().sum() if "Assigned date" in df_kpi.columns else 0
-    total_uploaded = df_kpi["Upload Date"].notna().sum() if "Upload Date" in df_kpi.columns else 0
-    total_approval = df_kpi["Approval date"].notna().sum() if "Approval date" in df_kpi.columns else 0
-    total_denial = df_kpi["Denial Date"].notna().sum() if "Denial Date" in df_kpi.columns else 0
-    
-    total_pending_shipping = 0
-    if "Chasing Disposition_clean" in df_kpi.columns: # 👈 (FIXED)
-        total_pending_shipping = df_kpi[ # 👈 (FIXED)
-            df_kpi["Chasing Disposition_clean"].eq("pending shipping") # 👈 (FIXED)
-        ].shape[0]
+    # 🆕 (FIXED) read from the milestone cube (filters without Chasing Disposition)
+    kpi_totals = aggregate_milestones(cube_slice(milestone_cube, kpi_selections, active_date_range))
+    total_leads = kpi_totals["Leads"]
+    total_completed = kpi_totals["Completion Date"]
+    total_assigned = kpi_totals["Assigned date"]
+    total_uploaded = kpi_totals["Upload Date"]
+    total_approval = kpi_totals["Approval date"]
+    total_denial = kpi_totals["Denial Date"]
+    total_pending_shipping = kpi_totals["Pending Shipping"]
 
     # Derived metrics
     total_not_assigned = total_leads - total_assigned
@@ -524,26 +2018,32 @@ if selected == "Dataset Overview":
     
     
     # --- Dates summary (table) ---
-    date_cols = df_filtered.select_dtypes(include=["datetime64[ns]"]).columns
+    date_cols = [
+        c for c in df_filtered.select_dtypes(include=["datetime64[ns]"]).columns
+        if not c.endswith(" (Date)")
+    ]
     if len(date_cols) > 0:
         st.markdown("### 📅 Date Ranges in Dataset")
+        parse_failures = df_cleaned.attrs.get("date_parse_failures", {})
         date_summary = pd.DataFrame({
             "Column": date_cols,
             "First Date": [df_filtered[c].min() for c in date_cols],
             "Last Date": [df_filtered[c].max() for c in date_cols],
+            "Unparsed Values (whole file)": [parse_failures.get(c, 0) for c in date_cols],
         })
         st.table(date_summary)
 
 
     # --- Numeric summary (table) ---
-    num_cols = df_filtered.select_dtypes(include=["int64", "float64"]).columns
+    num_cols = df_filtered.select_dtypes(include=["int64", "Int64", "float64"]).columns
     if len(num_cols) > 0:
         st.markdown("### 🔢 Numeric Columns Summary")
         num_summary = pd.DataFrame({
             "Column": num_cols,
             "Min": [df_filtered[c].min() for c in num_cols],
             "Max": [df_filtered[c].max() for c in num_cols],
-            "Mean": [round(df_filtered[c].mean(), 2) for c in num_cols]
+            # float64 first: the mean of an empty nullable Int64 column is pd.NA (round() fails on it)
+            "Mean": [round(df_filtered[c].astype("float64").mean(), 2) for c in num_cols]
         })
         st.table(num_summary)
 
@@ -568,23 +2068,13 @@ if selected == "Dataset Overview":
     desc = column_descriptions.get(selected_col, "No description available for this column.")
     
 
-    # --- Force date conversion for known date columns ---
-    date_columns_for_vis = [
-        "Date of Sale (Date)", "Created Time (Date)", "Assigned date (Date)",
-        "Approval date (Date)", "Denial Date (Date)",
-        "Completion Date (Date)", "Upload Date (Date)"
-    ]
-
-    for col in date_columns_for_vis:
-        if col in df_filtered.columns:
-            df_filtered[col] = pd.to_datetime(df_filtered[col], errors="coerce")
-
     # --- Extra Visualization (same logic you already have) ---
     # --- Extra Visualization ---
-    if selected_col in df_filtered.select_dtypes(include=["object"]).columns:
+    if selected_col in df_filtered.select_dtypes(include=["object", "category"]).columns:
         st.markdown(f"### 📊 Distribution of {selected_col}")
         chart_data = df_filtered[selected_col].value_counts().reset_index()
         chart_data.columns = [selected_col, "Count"]
+        chart_data = chart_data[chart_data["Count"] > 0]  # categoricals also count unused categories
 
         # 1. الأساس (Base)
         base = alt.Chart(chart_data).encode(
@@ -691,17 +2181,7 @@ elif selected == "Data Analysis":
     st.info("This page is for **deeper analysis** including time-series trends, insights summaries, and lead age analysis by Chaser / Client.")
 
     # --- Allowed columns for analysis ---
-    allowed_columns = [
-        "Created Time (Date)",
-        "Assigned date (Date)",
-        "Approval date (Date)",
-        "Denial Date (Date)",
-        "Completion Date (Date)",
-        "Upload Date (Date)",
-        "Date of Sale (Date)",
-    ]
-    
-    available_columns = [c for c in allowed_columns if c in df_filtered.columns]
+    available_columns = [c for c in ANALYSIS_DATE_COLS if c in df_filtered.columns]
     
     if not available_columns:
         st.warning("⚠️ None of the predefined analysis columns are available in the dataset.")
@@ -709,158 +2189,37 @@ elif selected == "Data Analysis":
         
     time_col = st.selectbox("Select column for analysis", available_columns)
     original_time_col = time_col.replace(" (Date)", "") 
-    
-    # Prepare df_ts
-    df_ts = df_filtered.copy() # 
-    if original_time_col in df_ts.columns:
-        df_ts = df_ts[df_ts[original_time_col].notna()].copy()
+    today = pd.Timestamp.now().normalize()
 
-        today = pd.Timestamp.now().normalize()
-        future_mask = df_ts[original_time_col].dt.normalize() > today
-        df_ts = df_ts.loc[~future_mask].copy()
+    # Cache key of every section below (together with the section's own widgets)
+    filter_state = canonical_filter_state(filter_index, main_selections, active_date_range)
+
+    # Working set (df_ts) = rows with the analysis date filled in and not in the future
+    if original_time_col in df_filtered.columns:
+        working_rows = int(working_set_mask(df_filtered, original_time_col, today).sum())
+    else:
+        working_rows = len(df_filtered)
 
-    st.markdown(f""" The working dataset for analysis contains **{len(df_ts)} rows**
-                      and **{len(df_ts.columns)} columns**.
+    st.markdown(f""" The working dataset for analysis contains **{working_rows} rows**
+                      and **{len(df_filtered.columns)} columns**.
                     """)
     table(df_filtered) 
             
     total_leads = len(df_filtered)
     
-    # --- Aggregation frequency ---
-    freq = st.radio("Aggregation level:", ["Daily", "Weekly", "Monthly"], horizontal=True)
-    period_map = {"Daily": "D", "Weekly": "W", "Monthly": "M"}
-    
-    if original_time_col in df_ts.columns:
-        df_ts["Period"] = df_ts[original_time_col].dt.to_period(period_map[freq]).dt.to_timestamp()
-    else:
-        df_ts = pd.DataFrame() 
-
-    # --- Grouping option ---
-    group_by = st.selectbox("Break down by:", ["None", "Client", "Chaser Name", "Chaser Group"])
-    if group_by == "None":
-        ts_data = df_ts.groupby("Period").size().reset_index(name="Lead Count")
-    else:
-        ts_data = df_ts.groupby(["Period", group_by]).size().reset_index(name="Lead Count")
-
-    if not ts_data.empty:
-        # 📈 Historical Time Series
-        st.subheader("📈 Historical Time Series")
-
-        if group_by == "None":
-            chart = (
-                alt.Chart(ts_data)
-                .mark_line(point=True, color="#007bff")
-                .encode(x="Period:T", y="Lead Count", tooltip=["Period:T", "Lead Count"])
-                .properties(height=400)
-            )
-        else:
-            chart = (
-                alt.Chart(ts_data)
-                .mark_line(point=True)
-                .encode(
-                    x="Period:T",
-                    y="Lead Count",
-                    color=group_by,
-                    tooltip=["Period:T", "Lead Count", group_by]
-                )
-                .properties(height=400)
-            )
-        st.altair_chart(chart, use_container_width=True)
+    # 📈 Aggregation level / Break down by rerun only this fragment
+    time_series_fragment(df_filtered, dataset_version, filter_state, time_col, today)
 
-
-        # 🏆 Top performers
-        if group_by in ["Chaser Name", "Client"]:
-            st.subheader(f"🏆 Top {group_by}s by Leads")
-            top_table = ts_data.groupby(group_by)["Lead Count"].sum().reset_index()
-            top_table = top_table.sort_values("Lead Count", ascending=False).head(40)
-            st.table(top_table)
-        
+    # Sections below need a non-empty working set
+    if working_rows > 0:
         
         # ================== Chasing Disposition Distribution (MODIFIED: Compact Metric) ==================
-        if "Chasing Disposition" in df_ts.columns:
+        if "Chasing Disposition" in df_filtered.columns:
             st.subheader("📊 Chasing Disposition Distribution")
 
-            metric_options_disp = [
-                "Total Leads (with Created Time (Date))",
-                "Total Assigned",
-                "Not Assigned",
-                "Total Approved",
-                "Total Denied",
-                "Total Completed",
-                "Total Uploaded"
-            ]
-            metric_option = st.selectbox(
-                "Select metric to display by Chasing Disposition:",
-                metric_options_disp
-            )
-
-            metrics_by_disp = df_ts.groupby("Chasing Disposition").agg({
-                "Created Time (Date)": "count",
-                "Assigned date": lambda x: x.notna().sum(),
-                "Approval date": lambda x: x.notna().sum(),
-                "Denial Date": lambda x: x.notna().sum(),
-                "Completion Date": lambda x: x.notna().sum(),
-                "Upload Date": lambda x: x.notna().sum(),
-            }).reset_index()
-
-            metrics_by_disp["Not Assigned"] = (
-                metrics_by_disp["Created Time (Date)"] - metrics_by_disp["Assigned date"]
-            )
-
-            metric_map = {
-                "Total Leads (with Created Time (Date))": "Created Time (Date)",
-                "Total Assigned": "Assigned date",
-                "Not Assigned": "Not Assigned",
-                "Total Approved": "Approval date",
-                "Total Denied": "Denial Date",
-                "Total Completed": "Completion Date",
-                "Total Uploaded": "Upload Date"
-            }
-
-            selected_col = metric_map[metric_option]
-            
-            chart_data = metrics_by_disp[["Chasing Disposition", selected_col]].rename(columns={selected_col: "Count"})
-
-            total_selected_metric = chart_data["Count"].sum()
-            
-            col_metric, col_spacer = st.columns([1, 4])
-            with col_metric:
-                st.metric(label=f"Total Count for: {metric_option}", value=f"{total_selected_metric:,}")
-            
-            total_for_percentage = total_selected_metric
-            
-            if total_for_percentage > 0:
-                chart_data["Percentage"] = (chart_data["Count"] / total_for_percentage * 100).round(1)
-                chart_data["Label"] = chart_data["Count"].apply(lambda x: f'{x:,}') 
-            else:
-                chart_data["Percentage"] = 0.0
-                chart_data["Label"] = chart_data["Count"].apply(lambda x: f'{x:,}')
-
-
-            chart_disp = (
-                alt.Chart(chart_data)
-                .mark_bar()
-                .encode(
-                    x=alt.X("Chasing Disposition", sort="-y", title="Chasing Disposition"),
-                    y=alt.Y("Count", title=selected_col.replace(" (Date)", "")),
-                    color="Chasing Disposition",
-                    tooltip=["Chasing Disposition", "Count", alt.Tooltip("Percentage", format=".1f", title="Percentage (%)")]
-                )
-                .properties(height=400)
+            milestone_distribution_fragment(
+                milestone_cube, dataset_version, filter_state, time_col, today, "Chasing Disposition", key="disposition_metric"
             )
-            
-            text = chart_disp.mark_text(
-                align='center',    
-                baseline='bottom', 
-                dy=-5,             
-                color='white',     
-                fontSize=12
-            ).encode(
-                text=alt.Text("Label") 
-            )
-
-            final_chart = chart_disp + text
-            st.altair_chart(final_chart, use_container_width=True)
 
 # --- 🔽🔽🔽 START OF NEW TREEMAP (Custom Colors for Parents) 🔽🔽🔽 ---
             st.markdown("---")
@@ -868,82 +2227,8 @@ elif selected == "Data Analysis":
 
             if "Chaser Name" in df_filtered.columns and "Chasing Disposition" in df_filtered.columns:
                 
-                # 1. تجهيز الداتا
-                df_tree = df_filtered.groupby(['Chaser Name', 'Chasing Disposition']).size().reset_index(name='Count')
-                df_tree = df_tree[df_tree['Count'] > 0] # نشيل الأصفار
-
-                # 2. تحضير القوائم لبناء الشجرة يدوياً (عشان نتحكم في الألوان)
-                import plotly.graph_objects as go
-
-                labels = []
-                parents = []
-                values = []
-                colors = []
-                ids = []
-
-                # --- Level 1: الجذر (All Agents) ---
-                root_id = "All Agents"
-                ids.append(root_id)
-                labels.append("All Agents")
-                parents.append("")
-                values.append(df_tree['Count'].sum())
-                colors.append("#37474F") # لون هادي جداً (رمادي غامق) للجذر
-
-                # --- Level 2: الايجنت (Chaser Name) ---
-                unique_chasers = df_tree['Chaser Name'].unique()
-                for chaser in unique_chasers:
-                    chaser_total = df_tree[df_tree['Chaser Name'] == chaser]['Count'].sum()
-                    ids.append(f"{root_id}/{chaser}")
-                    labels.append(chaser)
-                    parents.append(root_id)
-                    values.append(chaser_total)
-                    colors.append("#546E7A") # لون هادي (أزرق رمادي) للايجنت
-
-                # --- Level 3: الحالة (Status) ---
-                for _, row in df_tree.iterrows():
-                    chaser = row['Chaser Name']
-                    status = row['Chasing Disposition']
-                    count = row['Count']
-                    
-                    # تحديد لون الحالة
-                    s_lower = str(status).lower().strip()
-                    node_color = "#636EFA" # اللون الافتراضي (أزرق)
-                    
-                    if s_lower in ["dead lead", "dr denied", "rejected by dr chase"]:
-                        node_color = "#EF553B" # أحمر
-                    elif s_lower in ["pending shipping", "hot lead", "passed review"]:
-                        node_color = "#00CC96" # أخضر
-                    elif "fax" in s_lower:
-                        node_color = "#FFA15A" # برتقالي
-
-                    ids.append(f"{root_id}/{chaser}/{status}")
-                    labels.append(status)
-                    parents.append(f"{root_id}/{chaser}")
-                    values.append(count)
-                    colors.append(node_color)
-
-                # 3. رسم الـ Treemap
-                fig_tree = go.Figure(go.Treemap(
-                    ids=ids,
-                    labels=labels,
-                    parents=parents,
-                    values=values,
-                    marker=dict(
-                        colors=colors, # هنا بنطبق قايمة الألوان بتاعتنا
-                        line=dict(width=1, color='black') # حدود سوداء خفيفة
-                    ),
-                    branchvalues="total",
-                    textinfo="label+value+percent parent",
-                    textfont=dict(size=14)
-                ))
-
-                fig_tree.update_layout(
-                    template="plotly_dark",
-                    margin=dict(t=50, l=10, r=10, b=10),
-                    height=600,
-                    title="Hierarchical View: All Agents (Grey) ➡️ Status (Colored)"
-                )
-
+                # Built once per filter state (cached figure)
+                fig_tree = analysis_treemap_figure(df_filtered, dataset_version, filter_state)
                 st.plotly_chart(fig_tree, use_container_width=True)
             
             else:
@@ -955,112 +2240,32 @@ elif selected == "Data Analysis":
 
 
             # ================== Client Distribution (MODIFIED: Compact Metric) ==================
-        if "Client" in df_ts.columns:
+        if "Client" in df_filtered.columns:
             st.subheader("👥 Client Distribution")
         
-            metric_options_client = [
-                "Total Leads (with Created Time (Date))",
-                "Total Assigned",
-                "Not Assigned",
-                "Total Approved",
-                "Total Denied",
-                "Total Completed",
-                "Total Uploaded"
-            ]
-            metric_option_client = st.selectbox(
-                "Select metric to display by Client:",
-                metric_options_client,
-                key="client_metric"
-            )
-        
-            metrics_by_client = df_ts.groupby("Client").agg({
-                "Created Time (Date)": "count",
-                "Assigned date": lambda x: x.notna().sum(),
-                "Approval date": lambda x: x.notna().sum(),
-                "Denial Date": lambda x: x.notna().sum(),
-                "Completion Date": lambda x: x.notna().sum(),
-                "Upload Date": lambda x: x.notna().sum(),
-            }).reset_index()
-        
-            metrics_by_client["Not Assigned"] = metrics_by_client["Created Time (Date)"] - metrics_by_client["Assigned date"]
-        
-            metric_map = {
-                "Total Leads (with Created Time (Date))": "Created Time (Date)",
-                "Total Assigned": "Assigned date",
-                "Not Assigned": "Not Assigned",
-                "Total Approved": "Approval date",
-                "Total Denied": "Denial Date",
-                "Total Completed": "Completion Date",
-                "Total Uploaded": "Upload Date"
-            }
-            
-            selected_col_client = metric_map[metric_option_client]
-        
-            chart_data_client = metrics_by_client[["Client", selected_col_client]].rename(columns={selected_col_client: "Count"})
-
-            total_selected_metric_client = chart_data_client["Count"].sum()
-            
-            col_metric_client, col_spacer_client = st.columns([1, 4]) 
-            with col_metric_client:
-                st.metric(label=f"Total Count for: {metric_option_client}", value=f"{total_selected_metric_client:,}")
-            
-            total_for_percentage_client = total_selected_metric_client
-            
-            if total_for_percentage_client > 0:
-                chart_data_client["Percentage"] = (chart_data_client["Count"] / total_for_percentage_client * 100).round(1)
-                chart_data_client["Label"] = chart_data_client["Count"].apply(lambda x: f'{x:,}') 
-            else:
-                chart_data_client["Percentage"] = 0.0
-                chart_data_client["Label"] = chart_data_client["Count"].apply(lambda x: f'{x:,}')
-        
-            chart_disp_client = (
-                alt.Chart(chart_data_client)
-                .mark_bar()
-                .encode(
-                    x=alt.X("Client", sort="-y"),
-                    y=alt.Y("Count", title=selected_col_client.replace(" (Date)", "")),
-                    color="Client",
-                    tooltip=["Client", "Count", alt.Tooltip("Percentage", format=".1f", title="Percentage (%)")]
-                )
-                .properties(height=400)
-            )
-
-            text_client = chart_disp_client.mark_text(
-                align='center',    
-                baseline='bottom', 
-                dy=-5,             
-                color='white',     
-                fontSize=12
-            ).encode(
-                text=alt.Text("Label") 
+            milestone_distribution_fragment(
+                milestone_cube, dataset_version, filter_state, time_col, today, "Client", key="client_metric"
             )
-            
-            final_chart_client = chart_disp_client + text_client
-            st.altair_chart(final_chart_client, use_container_width=True)
 
         
         
         # 📝 Insights Summary
         st.subheader("📝 Insights Summary")
         
-        df_time = df_ts[df_ts[original_time_col].notna()].copy()
-        total_time_leads = len(df_time)
+        
+        time_totals = analysis_milestone_totals(milestone_cube, dataset_version, filter_state, time_col, today)
+        total_time_leads = time_totals["Leads"]
         
         st.write(f"Based on **{time_col}**, there are **{total_time_leads} leads** with this date.")
         
         if total_time_leads > 0:
-            total_assigned = df_time["Assigned date"].notna().sum() if "Assigned date" in df_time.columns else 0
+            total_assigned = time_totals["Assigned date"]
             total_not_assigned = total_time_leads - total_assigned
-            total_approval = df_time["Approval date"].notna().sum() if "Approval date" in df_time.columns else 0
-            total_denial = df_time["Denial Date"].notna().sum() if "Denial Date" in df_time.columns else 0
-            total_uploaded = df_time["Upload Date"].notna().sum() if "Upload Date" in df_time.columns else 0
-            total_completed = df_time["Completion Date"].notna().sum() if "Completion Date" in df_time.columns else 0
-            
-            total_pending_shipping = 0
-            if "Chasing Disposition_clean" in df_time.columns:
-                total_pending_shipping = df_time[ # 
-                    df_time["Chasing Disposition_clean"].eq("pending shipping") # 
-                ].shape[0]
+            total_approval = time_totals["Approval date"]
+            total_denial = time_totals["Denial Date"]
+            total_uploaded = time_totals["Upload Date"]
+            total_completed = time_totals["Completion Date"]
+            total_pending_shipping = time_totals["Pending Shipping"]
 
             # Show stats
             st.markdown(f"""
@@ -1075,236 +2280,28 @@ elif selected == "Data Analysis":
                 """)           
             
             st.subheader("🚨 Data Quality Warnings")
-            today = pd.Timestamp.now().normalize()
-
-            # 🚨 Check: Date of Sale is MORE THAN 7 DAYS BEFORE Created Time ONLY
-            if "Date of Sale" in df_filtered.columns and "Created Time" in df_filtered.columns:
-                
-                # 1. تحديد فترة السماحية (7 أيام)
-                buffer_days = pd.Timedelta(days=7)
-                
-                # 2. تجهيز التواريخ للمقارنة
-                sale_date = df_filtered["Date of Sale"].dt.normalize()
-                created_minus_7 = df_filtered["Created Time"].dt.normalize() - buffer_days
-                
-                # 3. الشرط: لو تاريخ البيع أقدم من (الإنشاء - 7 أيام)
-                mask_invalid_sale = (sale_date < created_minus_7)
-                
-                # 4. الفلترة
-                invalid_sales = df_filtered[
-                    df_filtered["Date of Sale"].notna() & mask_invalid_sale
-                ]
-
-                if not invalid_sales.empty:
-                    st.warning(f"⚠️ Found {len(invalid_sales)} leads where **Date of Sale** is more than **7 days BEFORE** Created Time.")
-                    with st.expander("🔍 View Illogical Sale Dates (>7 days before Creation)"):
-                        # بنعرض الأعمدة المهمة (بما فيها Assigned date لو موجود عشان السياق)
-                        cols_to_show = ["MCN", "Client", "Chaser Name", "Created Time (Date)", "Date of Sale (Date)"]
-                        if "Assigned date (Date)" in df_filtered.columns:
-                            cols_to_show.insert(4, "Assigned date (Date)")
-                            
-                        st.dataframe(
-                            invalid_sales[cols_to_show],
-                            use_container_width=True
-                        )
-
-            # 🚨 Leads with Pending Shipping but no Upload Date
-            if "Chasing Disposition_clean" in df_filtered.columns and "Upload Date" in df_filtered.columns:
-                mask_shipping = (
-                    df_filtered["Chasing Disposition_clean"].eq("pending shipping") # 
-                    & df_filtered["Upload Date"].isna()
-                )
-                
-                pending_shipping = df_filtered[mask_shipping]
-                
-                if not pending_shipping.empty:
-                    st.warning(f"⚠️ Found {len(pending_shipping)} leads with **Pending Shipping** but missing **Upload Date**.")
-                    with st.expander("🔍 View Pending Shipping Leads Without Upload Date"):
-                        st.dataframe(
-                            pending_shipping[[
-                                "MCN",
-                                "Created Time (Date)",
-                                "Assigned date (Date)",
-                                "Completion Date (Date)",
-                                "Upload Date (Date)",
-                                "Chasing Disposition",
-                                "Chaser Name",
-                                "Client"
-                            ]],
-                            use_container_width=True
-                        )
-                
-            # --- 🔽🔽🔽 (FIX) 
-            # 
-            if "Created Time (Date)" in df_filtered.columns and "Chasing Disposition_clean" in df_filtered.columns:
-                
-                # 
-                pending_mask_fax_call = (
-                    (df_filtered["Days Since Created"] > 5) &
-                    (df_filtered["Chasing Disposition_clean"].isin(["pending fax", "pending dr call"])) 
-                )
-                pending_leads_fax_call = df_filtered[pending_mask_fax_call]
-                
-                if not pending_leads_fax_call.empty:
-                    st.warning(f"⚠️ Found {len(pending_leads_fax_call)} leads pending for more than 5 days (Fax/Dr Call).")
-                    with st.expander("🔍 View Pending Leads > 5 Days (Fax/Dr Call)"): 
-                        st.dataframe(
-                            pending_leads_fax_call[[
-                                "MCN",
-                                "Created Time (Date)",
-                                "Days Since Created",
-                                "Chasing Disposition",
-                                "Assigned date (Date)",
-                                "Upload Date (Date)",
-                                "Completion Date (Date)",
-                                "Chaser Name",
-                                "Client",
-                                "Next Follow-up Date"
-                            ]],
-                            use_container_width=True
-                        )
-
-                # 
-                pending_mask_faxed = (
-                    (df_filtered["Days Since Created"] > 7) &
-                    (df_filtered["Chasing Disposition_clean"].isin(["faxed"])) 
-                )
-                pending_leads_faxed = df_filtered[pending_mask_faxed] 
-                
-                if not pending_leads_faxed.empty: 
-                    st.warning(f"⚠️ Found {len(pending_leads_faxed)} leads pending for more than 7 days (Faxed).") 
-                    with st.expander("🔍 View Pending Leads > 7 Days (Faxed)"): 
-                        st.dataframe(
-                            pending_leads_faxed[[ 
-                                "MCN",
-                                "Created Time (Date)",
-                                "Days Since Created",
-                                "Chasing Disposition",
-                                "Assigned date (Date)",
-                                "Upload Date (Date)",
-                                "Completion Date (Date)",
-                                "Chaser Name",
-                                "Client",
-                                "Next Follow-up Date"
-                            ]],
-                            use_container_width=True
-                        )
+            checks = analysis_data_quality(
+                df_filtered, df_oplan, mcn_join_index, quality_flags, dataset_version, oplan_version, filter_state, time_col, today
+            )
 
-                # 
-                pending_mask_dr_chase = (
-                    (df_filtered["Days Since Created"] > 5) &
-                    (df_filtered["Chasing Disposition_clean"].isin(["dr chase"])) 
-                )
-                pending_leads_dr_chase = df_filtered[pending_mask_dr_chase] 
-                
-                if not pending_leads_dr_chase.empty: 
-                    st.warning(f"⚠️ Found {len(pending_leads_dr_chase)} leads pending for more than 5 days (Dr Chase).") 
-                    with st.expander("🔍 View Pending Leads > 5 Days (Dr Chase)"): 
-                        st.dataframe(
-                            pending_leads_dr_chase[[ 
-                                "MCN",
-                                "Created Time (Date)",
-                                "Days Since Created",
-                                "Chasing Disposition",
-                                "Assigned date (Date)",
-                                "Upload Date (Date)",
-                                "Completion Date (Date)",
-                                "Chaser Name",
-                                "Client"
-                                # "Next Follow-up Date" 
-                            ]],
-                            use_container_width=True
-                        )
-            # --- 🔼🔼🔼 ---
-
-            # --- Row-level logic checks with expanders ---
-            if "Completion Date" in df_time.columns and "Assigned date" in df_time.columns:
-                bad_rows = df_time[df_time["Completion Date"].notna() & df_time["Assigned date"].isna()]
-                if not bad_rows.empty:
-                    st.warning(f"⚠️ Found {len(bad_rows)} leads with **Completion Date** but no **Assigned date**.")
-                    with st.expander("🔍 View Leads Missing Assigned Date"):
-                        st.dataframe(
-                            bad_rows[["MCN", "Client", "Chaser Name", "Created Time", "Assigned date", "Completion Date"]],
-                            use_container_width=True
-                        )
-            
-            if "Completion Date" in df_time.columns and "Approval date" in df_time.columns:
-                bad_rows2 = df_time[df_time["Completion Date"].notna() & df_time["Approval date"].isna()]
-                if not bad_rows2.empty:
-                    st.warning(f"⚠️ Found {len(bad_rows2)} leads with **Completion Date** but no **Approval date**.")
-                    with st.expander("🔍 View Leads Missing Approval Date"):
-                        st.dataframe(
-                            bad_rows2[["MCN", "Client", "Chaser Name", "Created Time", "Approval date", "Completion Date"]],
-                            use_container_width=True
-                        )
-            
-            # --- Extra checks for Uploaded Date ---
-            if "Upload Date" in df_time.columns and "Completion Date" in df_time.columns:
-                bad_uploaded = df_time[df_time["Upload Date"].notna() & df_time["Completion Date"].isna()]
-                if not bad_uploaded.empty:
-                    st.warning(f"⚠️ Found {len(bad_uploaded)} leads with **Upload Date** but no **Completion Date**.")
-                    with st.expander("🔍 View Leads Missing Completion Date after Upload"):
-                        st.dataframe(
-                            bad_uploaded[["MCN", "Client", "Chaser Name", "Upload Date", "Completion Date"]],
-                            use_container_width=True
-                        )
-            
-            if "Upload Date" in df_time.columns and "Assigned date" in df_time.columns:
-                bad_uploaded_assigned = df_time[df_time["Upload Date"].notna() & df_time["Assigned date"].isna()]
-                if not bad_uploaded_assigned.empty:
-                    st.warning(f"⚠️ Found {len(bad_uploaded_assigned)} leads with **Upload Date** but no **Assigned date**.")
-                    with st.expander("🔍 View Leads Missing Assigned Date after Upload"):
-                        st.dataframe(
-                            bad_uploaded_assigned[["MCN", "Client", "Chaser Name", "Upload Date", "Assigned date"]],
-                            use_container_width=True
-                        )
-            
-            if "Upload Date" in df_time.columns and "Approval date" in df_time.columns:
-                bad_uploaded_approval = df_time[df_time["Upload Date"].notna() & df_time["Approval date"].isna()]
-                if not bad_uploaded_approval.empty:
-                    st.warning(f"⚠️ Found {len(bad_uploaded_approval)} leads with **Upload Date** but no **Approval date**.")
-                    with st.expander("🔍 View Leads Missing Approval Date after Upload"):
-                        st.dataframe(
-                            bad_uploaded_approval[["MCN", "Client", "Chaser Name", "Upload Date", "Approval date"]],
-                            use_container_width=True
-                        )
+            # Counts up front; a table is only built once its section is opened
+            for rule in DATA_QUALITY_RULES:
+                positions = checks.get(rule["name"])
+                if positions is not None and len(positions):
+                    QUALITY_SEVERITY[rule["severity"]](f"⚠️ Found {len(positions)} {rule['message']}")
+                    if lazy_section(rule["title"], key=f"quality_{rule['name']}_open"):
+                        paged_dataframe(df_filtered, key=f"quality_{rule['name']}", rows=positions, columns=rule["display"])
             
             
             # 🚨 (NEW) Check for conflicting dispositions between Dr. Chase and O Plan
-            if (not df_oplan.empty and 
-                "MCN_clean" in df_filtered.columns and 
-                "MCN_clean" in df_oplan.columns and 
-                "Closing Status_clean" in df_oplan.columns and  # 
-                "Chasing Disposition_clean" in df_filtered.columns):
-                
-                # 1. Define the conflicting statuses (CORRECTED)
-                dr_chase_bad_dispos = ["dr denied", "rejected by dr chase", "dead lead"] # 
-                oplan_closing_dispo = "doctor chase" 
-
-                # 2. Find leads in O Plan with the closing status
-                oplan_conflicts = df_oplan[
-                    df_oplan["Closing Status_clean"].eq(oplan_closing_dispo) # 
-                ]
-                
-                # 3. Find leads in Dr. Chase (from the filtered list) with the bad status
-                dr_chase_conflicts = df_filtered[
-                    df_filtered["Chasing Disposition_clean"].isin(dr_chase_bad_dispos)
-                ]
-
-                # 4. Find the intersection (the MCNs present in both lists)
-                conflicting_leads = pd.merge(
-                    dr_chase_conflicts[["MCN_clean", "Chasing Disposition", "Chaser Name", "Client"]],
-                    oplan_conflicts[["MCN_clean", "Closing Status_clean"]], # 
-                    on="MCN_clean",
-                    how="inner",
-                    suffixes=('_DrChase', '_OPlan')
-                )
-                
-                # 5. Display the warning if any conflicts are found
-                if not conflicting_leads.empty:
-                    st.warning(f"⚠️ Found {len(conflicting_leads)} leads marked as Denied/Dead in Dr. Chase but '{oplan_closing_dispo}' in O Plan.")
-                    with st.expander("🔍 View Conflicting Leads"):
-                        st.dataframe(conflicting_leads, use_container_width=True)
+            if "conflicting_leads" in checks:
+                conflict_pos, conflict_oplan_pos = checks["conflicting_leads"]
+                if len(conflict_pos):
+                    st.warning(f"⚠️ Found {len(conflict_pos)} leads marked as Denied/Dead in Dr. Chase but '{OPLAN_CONFLICT_STATUS}' in O Plan.")
+                    if lazy_section("🔍 View Conflicting Leads", key="conflicting_leads_open"):
+                        paged_dataframe(
+                            conflict_rows(df_filtered, df_oplan, conflict_pos, conflict_oplan_pos), key="conflicting_leads"
+                        )
                 
                 else:
                     st.success("✅ تم فحص التطابق: لا يوجد أي تضارب بين ملف Dr. Chase وملف O Plan بخصوص الحالات المرفوضة.")
@@ -1315,34 +2312,16 @@ elif selected == "Data Analysis":
         st.subheader("⏳ Lead Age Analysis")
         st.info("Analysis of how long it takes for leads to get Approved / Denied. Includes weekly distribution, averages/medians, and grouped comparisons.")
         
-        if "Created Time" in df_ts.columns:
-            df_lead_age = df_ts.copy()
-        
-            # حساب Lead Age من Approval و Denial
-            if "Approval date" in df_lead_age.columns:
-                df_lead_age["Lead Age (Approval)"] = (
-                    (df_lead_age["Approval date"] - df_lead_age["Created Time"]).dt.days
-                )
-            if "Denial Date" in df_lead_age.columns:
-                df_lead_age["Lead Age (Denial)"] = (
-                    (df_lead_age["Denial Date"] - df_lead_age["Created Time"]).dt.days
-                )
-            
-            # --- KPIs Section ---
-            # 🆕 (FIXED) Filter for positive ages before calculating mean/median
-            positive_approval_ages = df_lead_age[df_lead_age["Lead Age (Approval)"] >= 0]["Lead Age (Approval)"]
-            positive_denial_ages = df_lead_age[df_lead_age["Lead Age (Denial)"] >= 0]["Lead Age (Denial)"]
-
-            total_approved = positive_approval_ages.notna().sum() # Count only positive approvals
-            total_denied = positive_denial_ages.notna().sum() # Count only positive denials
-            avg_approval_age = positive_approval_ages.mean(skipna=True)
-            avg_denial_age = positive_denial_ages.mean(skipna=True)
+        if "Created Time" in df_filtered.columns:
+            lead_age = analysis_lead_age(df_filtered, dataset_version, filter_state, time_col, today)
+            avg_approval_age = lead_age["avg_approval_age"]
+            avg_denial_age = lead_age["avg_denial_age"]
 
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("✔️ Total Approved (Week 0+)", f"{total_approved:,}")
+                st.metric("✔️ Total Approved (Week 0+)", f"{lead_age['total_approved']:,}")
             with col2:
-                st.metric("❌ Total Denied (Week 0+)", f"{total_denied:,}")
+                st.metric("❌ Total Denied (Week 0+)", f"{lead_age['total_denied']:,}")
             with col3:
                 st.metric("⏳ Avg Approval Age (Week 0+)", f"{avg_approval_age:.1f} days" if not pd.isna(avg_approval_age) else "N/A")
             with col4:
@@ -1361,262 +2340,85 @@ elif selected == "Data Analysis":
             )
         
             # 📋 Full Lead Age Table (hidden by default)
-            with st.expander("📋 View Full Lead Age Table (Includes Negatives)"):
-                st.dataframe(
-                    df_lead_age[[
-                        "Created Time (Date)",
-                        "Approval date",
-                        "Denial Date",
-                        "Lead Age (Approval)",
-                        "Lead Age (Denial)",
-                        "Chaser Name",
-                        "Client",
-                        "MCN"
-                    ]],
-                    use_container_width=True
-                )
+            if lazy_section("📋 View Full Lead Age Table (Includes Negatives)", key="lead_age_table_open"):
+                paged_dataframe(lead_age_rows(df_filtered, lead_age["table"], LEAD_AGE_TABLE_COLS), key="lead_age_table")
         
             # 🚨 Check for leads with both Approval & Denial
-            both_dates = df_lead_age[df_lead_age["Approval date"].notna() & df_lead_age["Denial Date"].notna()]
-            if not both_dates.empty:
+            both_dates = lead_age["both_dates"]
+            if len(both_dates):
                 st.warning(f"⚠️ Found {len(both_dates)} leads with BOTH Approval & Denial dates. Please review.")
-                with st.expander("🔍 View Leads with BOTH Approval & Denial"):
-                    cols_to_show = [
-                        "Created Time (Date)",
-                        "Approval date",
-                        "Denial Date",
-                        "Lead Age (Approval)",
-                        "Lead Age (Denial)",
-                        "Chaser Name",
-                        "Client",
-                        "MCN"
-                    ]
-                    available_cols = [c for c in cols_to_show if c in both_dates.columns]
-                    st.dataframe(both_dates[available_cols], use_container_width=True)
+                if lazy_section("🔍 View Leads with BOTH Approval & Denial", key="both_dates_open"):
+                    paged_dataframe(lead_age_rows(df_filtered, both_dates, LEAD_AGE_TABLE_COLS), key="both_dates")
             
             
-            # 📊 Lead Age Distribution – Approval
-            if "Lead Age (Approval)" in df_lead_age.columns:
-                df_lead_age["Approval Category"] = df_lead_age["Lead Age (Approval)"].dropna().apply(categorize_weeks)
-                approval_summary_all = df_lead_age["Approval Category"].value_counts().reset_index()
-                approval_summary_all.columns = ["Category", "Count"]
+            # 📊 Lead Age Distribution – Approval / Denial
+            for kind, bar_color in [("Approval", "#28a745"), ("Denial", "#dc3545")]:
+                if f"{kind.lower()}_summary" not in lead_age:
+                    continue
+                summary_all = lead_age[f"{kind.lower()}_summary"]
 
                 # 1. (Chart) Show positive-only chart
-                with st.expander("📊 Lead Age Distribution – Approval (Week 0+)"):
-                    approval_summary_positive = approval_summary_all[
-                        ~approval_summary_all["Category"].astype(str).str.contains("Week -")
-                    ].copy()
-                    
-                    category_order_positive = sorted(
-                        approval_summary_positive["Category"].dropna().unique(),
-                        key=lambda x: int(x.split()[1])
-                    )
-        
-                    chart_approval = (
-                        alt.Chart(approval_summary_positive)
-                        .mark_bar(color="#28a745") 
+                if lazy_section(f"📊 Lead Age Distribution – {kind} (Week 0+)", key=f"lead_age_chart_{kind.lower()}_open"):
+                    summary_positive = summary_all[summary_all["Week"] >= 0]  # sorted by week
+                    summary_positive = pd.DataFrame({
+                        "Category": week_labels(summary_positive["Week"]),
+                        "Count": summary_positive["Count"],
+                    })
+                    category_order_positive = summary_positive["Category"].tolist()
+        
+                    chart_age = (
+                        alt.Chart(summary_positive)
+                        .mark_bar(color=bar_color) 
                         .encode(
                             x=alt.X("Category", sort=category_order_positive), 
                             y="Count",
                             tooltip=["Category", "Count"]
                         )
                     )
-                    st.altair_chart(chart_approval, use_container_width=True)
+                    st.altair_chart(chart_age, use_container_width=True)
                     
                 # 2. (Warning Table) Show negative-only data
-                negative_approval = df_lead_age[
-                    df_lead_age["Approval Category"].astype(str).str.contains("Week -", na=False)
-                ]
-                if not negative_approval.empty:
-                    st.warning(f"⚠️ Found {len(negative_approval)} approvals with negative week categories (before Week 0).")
-                    with st.expander("🔍 View Negative Week Approvals"): # 👈 This is no longer nested
-                        st.dataframe(
-                            negative_approval[[
-                                "Created Time", "Approval date", "Lead Age (Approval)",
-                                "Approval Category", "Chaser Name", "Client", "MCN"
-                            ]],
-                            use_container_width=True
-                        )
-
-        
-            # 📊 Lead Age Distribution – Denial
-            if "Lead Age (Denial)" in df_lead_age.columns:
-                df_lead_age["Denial Category"] = df_lead_age["Lead Age (Denial)"].dropna().apply(categorize_weeks)
-                denial_summary_all = df_lead_age["Denial Category"].value_counts().reset_index()
-                denial_summary_all.columns = ["Category", "Count"]
-
-                # 1. (Chart) Show positive-only chart
-                with st.expander("📊 Lead Age Distribution – Denial (Week 0+)"):
-                    denial_summary_positive = denial_summary_all[
-                        ~denial_summary_all["Category"].astype(str).str.contains("Week -")
-                    ].copy()
-                    
-                    category_order_positive = sorted(
-                        denial_summary_positive["Category"].dropna().unique(),
-                        key=lambda x: int(x.split()[1])
-                    )
-        
-                    chart_denial = (
-                        alt.Chart(denial_summary_positive)
-                        .mark_bar(color="#dc3545") 
-                        .encode(
-                            x=alt.X("Category", sort=category_order_positive),
-                            y="Count",
-                            tooltip=["Category", "Count"]
-                        )
-                    )
-                    st.altair_chart(chart_denial, use_container_width=True)
-                
-                # 2. (Warning Table) Show negative-only data
-                negative_denial = df_lead_age[
-                    df_lead_age["Denial Category"].astype(str).str.contains("Week -", na=False)
-                ]
-                if not negative_denial.empty:
-                    st.warning(f"⚠️ Found {len(negative_denial)} denials with negative week categories (before Week 0).")
-                    with st.expander("🔍 View Negative Week Denials"): # 👈 This is no longer nested
-                        st.dataframe(
-                            negative_denial[[
-                                "Created Time", "Denial Date", "Lead Age (Denial)",
-                                "Denial Category", "Chaser Name", "Client", "MCN"
-                            ]],
-                            use_container_width=True
-                        )
-
-        
-            # 📊 Grouped Bar Chart – Approval vs Denial per Chaser
-            if "Chaser Name" in df_lead_age.columns:
-                st.markdown("### 📊 Approval vs Denial Lead Age by Chaser (Week 0+)")
-                
-                # 🆕 Filter for positive-only data *before* melting
-                df_lead_age_positive = df_lead_age.copy()
-                if "Lead Age (Approval)" in df_lead_age_positive.columns:
-                    df_lead_age_positive["Lead Age (Approval)"] = df_lead_age_positive["Lead Age (Approval)"].apply(lambda x: x if x >= 0 else pd.NA)
-                if "Lead Age (Denial)" in df_lead_age_positive.columns:
-                    df_lead_age_positive["Lead Age (Denial)"] = df_lead_age_positive["Lead Age (Denial)"].apply(lambda x: x if x >= 0 else pd.NA)
-
-                grouped_chaser = pd.melt(
-                    df_lead_age_positive, # 👈 Use the positive-only DF
-                    id_vars=["Chaser Name"],
-                    value_vars=["Lead Age (Approval)", "Lead Age (Denial)"],
-                    var_name="Type",
-                    value_name="Days"
-                ).dropna()
-        
-                chart_grouped_chaser = (
-                    alt.Chart(grouped_chaser)
-                    .mark_bar()
-                    .encode(
-                        x="Chaser Name",
-                        y="mean(Days)",
-                        color="Type",
-                        tooltip=["Chaser Name", "Type", "mean(Days)"]
-                    )
-                )
-                st.altair_chart(chart_grouped_chaser, use_container_width=True)
-        
-            # 📊 Grouped Bar Chart – Approval vs Denial per Client
-            if "Client" in df_lead_age.columns:
-                st.markdown("### 📊 Approval vs Denial Lead Age by Client (Week 0+)")
-                
-                # 🆕 We can reuse df_lead_age_positive from above
-                grouped_client = pd.melt(
-                    df_lead_age_positive, # 👈 Use the positive-only DF
-                    id_vars=["Client"],
-                    value_vars=["Lead Age (Approval)", "Lead Age (Denial)"],
-                    var_name="Type",
-                    value_name="Days"
-                ).dropna()
-        
-                chart_grouped_client = (
-                    alt.Chart(grouped_client)
+                negative_rows = lead_age[f"negative_{kind.lower()}"]
+                if len(negative_rows):
+                    st.warning(f"⚠️ Found {len(negative_rows)} {kind.lower()}s with negative week categories (before Week 0).")
+                    if lazy_section(f"🔍 View Negative Week {kind}s", key=f"negative_{kind.lower()}_open"):
+                        date_col = "Approval date" if kind == "Approval" else "Denial Date"
+                        paged_dataframe(lead_age_rows(df_filtered, negative_rows, [
+                            "Created Time", date_col, f"Lead Age ({kind})", f"{kind} Category", "Chaser Name", "Client", "MCN"
+                        ]), key=f"negative_{kind.lower()}")
+
+        
+            # 📊 Grouped Bar Chart – Approval vs Denial per Chaser / Client
+            for dim in ["Chaser Name", "Client"]:
+                if f"grouped_{dim}" not in lead_age:
+                    continue
+                st.markdown(f"### 📊 Approval vs Denial Lead Age by {'Chaser' if dim == 'Chaser Name' else dim} (Week 0+)")
+                # Aggregated server-side: one row per (dim, Type)
+                chart_grouped = (
+                    alt.Chart(lead_age[f"grouped_{dim}"])
                     .mark_bar()
                     .encode(
-                        x="Client",
-                        y="mean(Days)",
+                        x=dim,
+                        y=alt.Y("Mean", title="Mean of Days"),
                         color="Type",
-                        tooltip=["Client", "Type", "mean(Days)"]
+                        tooltip=[
+                            dim, "Type",
+                            alt.Tooltip("Mean", format=".1f", title="Mean (days)"),
+                            alt.Tooltip("Median", format=".1f", title="Median (days)"),
+                            alt.Tooltip("P90", format=".1f", title="P90 (days)"),
+                            alt.Tooltip("Count", title="Leads"),
+                        ]
                     )
                 )
-                st.altair_chart(chart_grouped_client, use_container_width=True)
+                st.altair_chart(chart_grouped, use_container_width=True)
 
         st.markdown("---")
         st.markdown("### 🕰️ Not Touched Leads (Since Oct 1st, 2025)")
         
-        today = pd.Timestamp.now().normalize()
-        
-        start_date_filter = pd.Timestamp("2025-10-01").normalize()
-
-        group_1_statuses = ["pending dr call", "pending fax", "pending dr visit"]
-        group_2_statuses = ["pending dr call", "pending fax", "pending dr visit", "faxed", "dr chase"]
         required_cols = ["Assigned date", "Modified Time", "Created Time", "Completion Date", "Chasing Disposition_clean"]
         
         if all(col in df_filtered.columns for col in required_cols):
-
-            # 1. Leads Assigned > 7 Days ago (Group 1 Statuses)
-            threshold_7_days = today - pd.Timedelta(days=7)
-            
-            mask_assign_7 = (
-                (df_filtered["Assigned date"].dt.normalize() < threshold_7_days) & # فات 7 أيام
-                (df_filtered["Completion Date"].isna()) & # لسه مفتوحة
-                (df_filtered["Created Time"] >= start_date_filter) & # 🆕 من بعد 1/10/2025
-                (df_filtered["Chasing Disposition_clean"].isin(group_1_statuses)) # الحالات المحددة
-            )
-            leads_assign_7 = df_filtered[mask_assign_7]
-
-            if not leads_assign_7.empty:
-                st.warning(f"⚠️ Found **{len(leads_assign_7)}** active leads assigned > **7 days** ago (Pending Call/Fax/Visit).")
-                with st.expander("🔍 View Leads (Assigned > 7 Days - Group 1)"):
-                    st.dataframe(
-                        leads_assign_7[[
-                            "MCN", "Client", "Chaser Name", "Assigned date (Date)", 
-                            "Chasing Disposition", "Created Time (Date)"
-                        ]], 
-                        use_container_width=True
-                    )
-
-            # 2. Leads Last Modified > 7 Days ago (Group 2 Statuses)
-            threshold_mod_7 = today - pd.Timedelta(days=7)
-            
-            mask_mod_7 = (
-                (df_filtered["Modified Time"].dt.normalize() < threshold_mod_7) & # ماتعدلتش من 7 أيام
-                (df_filtered["Completion Date"].isna()) & 
-                (df_filtered["Created Time"] >= start_date_filter) & # 🆕 من بعد 1/10/2025
-                (df_filtered["Chasing Disposition_clean"].isin(group_2_statuses)) # الحالات الأوسع
-            )
-            leads_mod_7 = df_filtered[mask_mod_7]
-
-            if not leads_mod_7.empty:
-                st.warning(f"⚠️ Found **{len(leads_mod_7)}** active leads not modified for > **7 days**.")
-                with st.expander("🔍 View  Leads (Last Modified > 7 Days - Group 2)"):
-                    st.dataframe(
-                        leads_mod_7[[
-                            "MCN", "Client", "Chaser Name", "Modified Time", 
-                            "Chasing Disposition", "Last Modified By"
-                        ]], 
-                        use_container_width=True
-                    )
-
-            # 3. Leads Assigned > 14 Days ago (Group 2 Statuses - Critical)
-            threshold_14_days = today - pd.Timedelta(days=14)
-            
-            mask_assign_14 = (
-                (df_filtered["Assigned date"].dt.normalize() < threshold_14_days) & # فات 14 يوم
-                (df_filtered["Completion Date"].isna()) & 
-                (df_filtered["Created Time"] >= start_date_filter) & # 🆕 من بعد 1/10/2025
-                (df_filtered["Chasing Disposition_clean"].isin(group_2_statuses)) # الحالات الأوسع
-            )
-            leads_assign_14 = df_filtered[mask_assign_14]
-
-            if not leads_assign_14.empty:
-                st.error(f"🚨 Found **{len(leads_assign_14)}** active leads assigned > **14 days** ago !")
-                with st.expander("🔍 View Leads (Assigned > 14 Days - Group 2)"):
-                    st.dataframe(
-                        leads_assign_14[[
-                            "MCN", "Client", "Chaser Name", "Assigned date (Date)", 
-                            "Chasing Disposition", "Created Time (Date)"
-                        ]], 
-                        use_container_width=True
-                    )
+            not_touched_fragment(df_filtered, aging_index, dataset_version, filter_state, today)
         
         st.markdown("---")
 
@@ -1624,60 +2426,27 @@ elif selected == "Data Analysis":
         st.subheader("🔍 Duplicate Leads by MCN (Considering Product)")
         
         if "MCN" in df_filtered.columns and "Products" in df_filtered.columns:
+            dups = analysis_duplicates(
+                df_filtered, build_duplicate_index(df_cleaned, dataset_version), dataset_version, filter_state
+            )
+
             # --- Duplicates with same MCN and same Product ---
-            dup_same_product = df_filtered[df_filtered.duplicated(subset=["MCN", "Products"], keep=False)].copy()
-        
-            if not dup_same_product.empty:
-                st.warning(f"⚠️ Found {dup_same_product['MCN'].nunique()} unique MCNs duplicated with SAME Product "
-                           f"(total {len(dup_same_product)} rows).")
-                
-                required_cols = [
-                    "MCN", 
-                    "Products", 
-                    "Created Time", 
-                    "Date of Sale", 
-                    "Dr Name", 
-                    "Client", 
-                    "Chaser Name", 
-                    "Chasing Disposition"
-                ]
-                
-                available_dup_cols = [c for c in required_cols if c in df_filtered.columns]
+            if len(dups["same_product"]):
+                st.warning(f"⚠️ Found {dups['same_product_mcns']} unique MCNs duplicated with SAME Product "
+                           f"(total {len(dups['same_product'])} rows).")
                 
                 st.markdown("### 📋 Duplicate Leads (MCN & Product) Details")
-                st.dataframe(
-                    dup_same_product.sort_values(["MCN", "Products", "Created Time"])[available_dup_cols],
-                    use_container_width=True
-                )
+                paged_dataframe(df_filtered, key="dups_same_product", rows=dups["same_product"], columns=DUP_SAME_PRODUCT_COLS)
                 
             else:
                 st.success("✅ No duplicate MCNs found with SAME product.")
         
             # --- Duplicates with different Product ---
-            dup_diff_product_check = df_filtered[df_filtered.duplicated(subset=["MCN"], keep=False)].copy()
-            
-            dup_diff_product_grouped = dup_diff_product_check.groupby("MCN")["Products"].nunique().reset_index()
-            mcn_with_diff_products = dup_diff_product_grouped[dup_diff_product_grouped["Products"] > 1]["MCN"]
-
-            dup_diff_product = dup_diff_product_check[dup_diff_product_check["MCN"].isin(mcn_with_diff_products)].copy() 
-            
-            if not dup_diff_product.empty:
-                st.info(f"ℹ️ Found {len(mcn_with_diff_products)} MCNs with DIFFERENT Products (not real dups).")
+            if len(dups["diff_product"]):
+                st.info(f"ℹ️ Found {dups['diff_product_mcns']} MCNs with DIFFERENT Products (not real dups).")
         
-                with st.expander("📋 View MCNs with Different Products"):
-                    cols_to_show_old = [
-                        "MCN","Products","Chaser Name","Chaser Group","Date of Sale (Date)","Created Time (Date)",
-                        "Assigned date (Date)","Approval date (Date)","Denial Date (Date)",
-                        "Completion Date (Date)","Upload Date (Date)","Client",
-                        "Chasing Disposition","Insurance","Type Of Sale"
-                    ]
-                    available_cols_for_diff_dups = [c for c in cols_to_show_old if c in dup_diff_product.columns]
-                    
-                    merged = dup_diff_product.merge(dup_diff_product_grouped[["MCN"]], on="MCN")
-                    st.dataframe(
-                        merged.sort_values(["MCN", "Products"])[available_cols_for_diff_dups],
-                        use_container_width=True
-                    )
+                if lazy_section("📋 View MCNs with Different Products", key="dups_diff_product_open"):
+                    paged_dataframe(df_filtered, key="dups_diff_product", rows=dups["diff_product"], columns=DUP_DIFF_PRODUCT_COLS)
         
         else:
             st.info("ℹ️ Columns **MCN** and/or **Products** not found in dataset.")
@@ -1686,80 +2455,27 @@ elif selected == "Data Analysis":
     st.markdown("---") 
     st.subheader("📊 Agent Performance Analysis")
 
-    # 1. Merge the filtered data (df_ts) with O Plan data
-    df_merged_analysis = pd.DataFrame()
-    if (not df_oplan.empty and 
-        "MCN_clean" in df_ts.columns and 
-        "MCN_clean" in df_oplan.columns and
+    # 1. Join the working set (df_ts) with O Plan data through the MCN join index
+    if (mcn_join_index is not None and
         "Assign To_clean" in df_oplan.columns and
-        "Chasing Disposition_clean" in df_ts.columns and
-        "Client" in df_ts.columns): 
-        
-        # 
-        df_ts_subset = df_ts[["MCN_clean", "Chasing Disposition_clean", "Chasing Disposition", "Client"]]
-        df_oplan_subset = df_oplan[["MCN_clean", "Assign To_clean"]]
-        
-        df_merged_analysis = pd.merge(
-            df_ts_subset, 
-            df_oplan_subset, 
-            on="MCN_clean", 
-            how="inner" # 
+        "Chasing Disposition_clean" in df_filtered.columns and
+        "Client" in df_filtered.columns): 
+        agent_performance = analysis_agent_performance(
+            df_filtered, df_oplan, mcn_join_index, dataset_version, oplan_version, filter_state, time_col, today
         )
-        
-        # 
-        done_statuses = ["hot lead", "pending shipping", "passed review"]
-        df_merged_analysis['is_done'] = df_merged_analysis['Chasing Disposition_clean'].isin(done_statuses)
+    else:
+        agent_performance = pd.DataFrame()
 
-    if not df_merged_analysis.empty:
+    if not agent_performance.empty:
         
         # --- (Client Filter REMOVED as requested) ---
-        
-        # 3. 
-        df_agent_analysis = df_merged_analysis.copy() # 
 
         # --- 4. KPI Section ---
         st.markdown("### 📈 Agent Performance KPIs")
-        agent_list = sorted(df_agent_analysis["Assign To_clean"].unique())
-        kpi_agent = st.selectbox("Select O Plan Agent for KPIs:", ["All Agents"] + agent_list, key="kpi_agent_select")
-        
-        # Filter for the selected agent
-        if kpi_agent == "All Agents":
-            df_kpi_data = df_agent_analysis
-            kpi_title = "All Agents"
-        else:
-            df_kpi_data = df_agent_analysis[df_agent_analysis["Assign To_clean"] == kpi_agent]
-            kpi_title = kpi_agent
-        
-        # Calculate KPIs
-        total_leads_for_agent = len(df_kpi_data)
-        total_done = df_kpi_data['is_done'].sum()
-        pct_done = (total_done / total_leads_for_agent * 100) if total_leads_for_agent > 0 else 0
-        
-        # Show KPIs
-        kpi_col1, kpi_col2, kpi_col3 = st.columns(3)
-        kpi_col1.metric(f"Total Leads for {kpi_title}", total_leads_for_agent)
-        kpi_col2.metric(f"'Done' Leads (Hot, Pending, Passed)", total_done)
-        kpi_col3.metric(f"'Done' Rate", f"{pct_done:.1f}%")
-        
-        # (FIXED) 
-        style_metric_cards(
-            background_color="#0E1117",
-            border_left_color="#FF4B4B", 
-            border_color="#444",
-            box_shadow="2px 2px 10px rgba(0,0,0,0.5)"
-        )
+        agent_kpi_fragment(agent_performance)
 
         # --- 5. Chart Section ---
         
-        agent_performance = df_agent_analysis.groupby('Assign To_clean').agg(
-                Total_Leads=('MCN_clean', 'count'),
-                Done_Leads=('is_done', 'sum')
-            ).reset_index()
-        agent_performance['Done Rate'] = (agent_performance['Done_Leads'] / agent_performance['Total_Leads']).fillna(0) * 100
-        agent_performance_chart_data = agent_performance.sort_values(by="Done_Leads", ascending=False)
-        
-        
-
         # --- 🔽🔽🔽 START OF EDITED SECTION (Display as DataFrames) 🔽🔽🔽 ---
         
         # 
@@ -1805,34 +2521,21 @@ elif selected == "Data Analysis":
 
 # --- 🔽🔽🔽 START OF Difference leads 🔽🔽🔽 ---
     st.markdown("---")
-    df_discrepancy_analysis = pd.DataFrame()
-    if (not df_oplan.empty and 
-        "MCN_clean" in df_ts.columns and 
-        "MCN_clean" in df_oplan.columns and
-        "Client" in df_ts.columns): 
-        
-        df_ts_subset = df_ts[["MCN_clean", "Client"]]
-        df_oplan_mcn = df_oplan[["MCN_clean"]]
-
-        df_discrepancy_analysis = pd.merge(
-            df_ts, 
-            df_oplan_mcn, 
-            on="MCN_clean", 
-            how="outer", 
-            indicator=True 
-        )
+    if mcn_join_index is not None and "Client" in df_filtered.columns:
+        # "Both" Period follows the Aggregation level (its fragment reruns the page while that table is open)
 
-        df_chase_only = df_discrepancy_analysis[df_discrepancy_analysis['_merge'] == 'left_only']
-        
-        df_oplan_only = df_discrepancy_analysis[df_discrepancy_analysis['_merge'] == 'right_only']
-
-        df_matched = df_discrepancy_analysis[df_discrepancy_analysis['_merge'] == 'both']
+        difference = analysis_difference_leads(
+            df_filtered, mcn_join_index, dataset_version, oplan_version, filter_state, time_col, today
+        )
+        chase_only, chase_labels = difference["chase_only"]
+        oplan_only, oplan_labels = difference["oplan_only"]
+        matched, matched_labels = difference["both"]
 
         st.markdown("### 📈 Difference leads")
         kpi_col1, kpi_col2, kpi_col3 = st.columns(3)
-        kpi_col1.metric("✅ Leads in Both Files", len(df_matched))
-        kpi_col2.metric("⚠️ Leads in Dr. Chase ONLY", len(df_chase_only))
-        kpi_col3.metric("⚠️ Leads in O Plan ONLY", len(df_oplan_only))
+        kpi_col1.metric("✅ Leads in Both Files", len(matched))
+        kpi_col2.metric("⚠️ Leads in Dr. Chase ONLY", len(chase_only))
+        kpi_col3.metric("⚠️ Leads in O Plan ONLY", len(oplan_only))
         
         style_metric_cards(
             background_color="#0E1117",
@@ -1841,27 +2544,23 @@ elif selected == "Data Analysis":
             box_shadow="2px 2px 10px rgba(0,0,0,0.5)"
         )
 
-        if not df_chase_only.empty:
-            with st.expander(f"🔍 View {len(df_chase_only)} Leads: In Dr. Chase ONLY"):
-                st.dataframe(df_chase_only[["MCN_clean", "Client"]], use_container_width=True)
+        if len(chase_only):
+            if lazy_section(f"🔍 View {len(chase_only)} Leads: In Dr. Chase ONLY", key="chase_only_open"):
+                paged_dataframe(
+                    difference_rows(df_filtered, chase_only, chase_labels, ["MCN_clean", "Client"]), key="chase_only"
+                )
 
-        if not df_oplan_only.empty:
-            with st.expander(f"🔍 View {len(df_oplan_only)} Leads: In O Plan ONLY"):
-                st.dataframe(df_oplan_only[["MCN_clean"]], use_container_width=True)
+        if len(oplan_only):
+            if lazy_section(f"🔍 View {len(oplan_only)} Leads: In O Plan ONLY", key="oplan_only_open"):
+                paged_dataframe(difference_rows(df_oplan, oplan_only, oplan_labels, ["MCN_clean"]), key="oplan_only")
 
-        if not df_matched.empty:
-            with st.expander(f"✅ View {len(df_matched)} Leads: Found in BOTH Files (Full Data)"):
-                display_matched = df_matched.drop(columns=['_merge'])
-                st.dataframe(display_matched, use_container_width=True)
+        if len(matched):
+            if lazy_section(f"✅ View {len(matched)} Leads: Found in BOTH Files (Full Data)", key="matched_leads_open"):
+                paged_dataframe(
+                    matched_rows(df_filtered, matched, matched_labels, time_col, st.session_state.get("aggregation_level", "Daily")),
+                    key="matched_leads"
+                )
             
     else:
         st.warning("Could not perform Discrepancy analysis. Ensure 'O_Plan_Leads.csv' is loaded and contains an 'MCN' column.")
     # --- 🔼🔼🔼 END OF SECTION 🔼🔼🔼 ---
-
-
-
-
-
-
-
-
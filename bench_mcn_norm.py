@@ -0,0 +1,48 @@
+"""Micro-benchmark: row-wise `MCN.apply(norm)` vs `norm_series(MCN)`.
+
+Run with:  python bench_mcn_norm.py [rows]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_utils import norm, norm_series
+
+
+def make_mcns(n_rows, seed=0):
+    # Roughly what the export looks like: every MCN appears about twice, mixed
+    # case, stray spaces/dashes/slashes and ~1% missing values.
+    rng = np.random.default_rng(seed)
+    n_patients = max(n_rows // 2, 1)
+    ids = rng.integers(100_000, 10_000_000, n_patients).astype(str)
+    sep = rng.choice(np.array(["", "-", " ", "."]), n_patients)
+    suffix = rng.choice(np.array(["A", "a", "B-1", " c ", "D/2"]), n_patients)
+    patients = np.char.add(np.char.add(ids, sep), suffix).astype(object)
+    mcns = pd.Series(patients[rng.integers(0, n_patients, n_rows)], dtype=object)
+    mcns[rng.random(n_rows) < 0.01] = np.nan
+    return mcns
+
+
+def best_of(func, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    mcns = make_mcns(n_rows)
+
+    t_apply, expected = best_of(lambda: mcns.apply(norm))
+    t_vector, result = best_of(lambda: norm_series(mcns))
+    pd.testing.assert_series_equal(result, expected)
+
+    print(f"rows: {n_rows:,} (unique MCNs: {mcns.nunique():,})")
+    print(f".apply(norm):   {t_apply:.3f}s")
+    print(f"norm_series():  {t_vector:.3f}s")
+    print(f"speed-up:       {t_apply / t_vector:.1f}x (outputs identical)")
@@ -0,0 +1,68 @@
+"""Pure pandas helpers shared by APP.py and offline scripts (no Streamlit imports)."""
+import re
+
+import numpy as np
+import pandas as pd
+
+
+def norm(s: str) -> str:
+    return re.sub(r'[^a-z0-9]+', '', str(s).strip().lower())
+
+def norm_series(series: pd.Series) -> pd.Series:
+    """Vectorised `series.apply(norm)`, same output.
+
+    Runs on Arrow string kernels instead of one Python call per row.
+    (No separate strip(): the regex already drops the whitespace.)
+    """
+    return (
+        series.astype(str)  # NaN -> "nan", like str(NaN) in norm()
+        .astype("string[pyarrow]")
+        .str.lower()
+        .str.replace(r'[^a-z0-9]+', '', regex=True)
+        .astype(object)
+    )
+
+def find_col(df_cols, candidates):
+    cand_norm = {norm(c) for c in candidates}
+    for c in df_cols:
+        if norm(c) in cand_norm:
+            return c
+    return None
+
+def duplicate_index(df: pd.DataFrame, key: str = "MCN", product: str = "Products") -> dict:
+    """Factorises (key, product) once; the duplicate checks then only filter group ids.
+
+    Missing keys / products are groups of their own, like `DataFrame.duplicated`.
+    `product_counts` is the number of distinct (non-missing) products per key.
+    """
+    key_ids, key_uniques = pd.factorize(df[key], use_na_sentinel=False)
+    product_ids, product_uniques = pd.factorize(df[product], use_na_sentinel=False)
+    pair_ids, pairs = pd.factorize(key_ids.astype(np.int64) * len(product_uniques) + product_ids)
+    pair_key = pairs // max(len(product_uniques), 1)
+    pair_has_product = pd.notna(product_uniques)[pairs % max(len(product_uniques), 1)]
+    return {
+        "key_ids": key_ids,
+        "pair_ids": pair_ids,
+        "pair_key": pair_key,
+        "pair_has_product": pair_has_product,
+        "key_is_missing": pd.isna(key_uniques),
+        "product_counts": np.bincount(pair_key[pair_has_product], minlength=len(key_uniques)),
+    }
+
+def duplicate_masks(index: dict, positions=None) -> tuple:
+    """(same-product duplicates, keys with several different products) as row masks.
+
+    Same sets as `duplicated([key, product], keep=False)` and
+    `groupby(key)[product].nunique() > 1`. `positions` restricts the check to those
+    rows (e.g. a filtered view; masks follow its order), None means every row.
+    """
+    key_ids, pair_ids = index["key_ids"], index["pair_ids"]
+    product_counts = index["product_counts"]
+    if positions is not None:
+        key_ids, pair_ids = key_ids[positions], pair_ids[positions]
+        present = np.unique(pair_ids)
+        present = present[index["pair_has_product"][present]]
+        product_counts = np.bincount(index["pair_key"][present], minlength=len(product_counts))
+    same = np.bincount(pair_ids, minlength=len(index["pair_key"]))[pair_ids] > 1
+    several = (product_counts > 1) & ~index["key_is_missing"]  # groupby drops missing keys
+    return same, several[key_ids]